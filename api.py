@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from typing import List, Optional
+from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager, contextmanager
+from db_executor import DatabaseExecutor
+from models import (Project, Dataset, DatasetWithMetadata, PatientWithSampleCount, PatientWithSamples, Sample,
+                    RawFileResponse, RawFileCreate, DatasetMetadataUpsert, MetadataUpdate)
+from fieldsets import FieldsQuery, parse_fields, sparse_model, sparse_response
+from conditional import project_etag, etag_matches, not_modified, set_etag
+from response_cache import ResponseCache
+from pagination import (LimitQuery, AfterQuery, NEXT_CURSOR_HEADER, decode_cursor, page_limit, split_page,
+                        set_next_cursor)
+from storage import merge_raw_file_payload
+from streaming import wants_ndjson, ndjson_response, ndjson_text_response, json_text_response
+
+logger = logging.getLogger(__name__)
+
+# Longest wait between attempts to reach the database on startup, in seconds
+STARTUP_RETRY_MAX_DELAY = 30
+
+
+def create_app(storage, max_workers=None, response_cache=None):
+    """The REDMANE API on top of a storage backend (see storage.py)
+
+    Project and dataset reads are served from `response_cache` (see
+    response_cache.py); writes through the API invalidate it.
+    """
+    # Cached per worker, sized from the environment unless given; RESPONSE_CACHE_SIZE=0 turns the cache off
+    if response_cache is None:
+        response_cache = ResponseCache(
+            max_size=int(os.getenv('RESPONSE_CACHE_SIZE', 256)),
+            ttl=float(os.getenv('RESPONSE_CACHE_TTL', 30)),
+        )
+
+    # Queries run on worker threads so a slow query never blocks the event loop
+    db_executor = DatabaseExecutor(max_workers=max_workers or storage.max_workers)
+
+    async def warm_up():
+        """Start the storage in the background, retrying with backoff while the database is unreachable"""
+        delay = 0.5
+        while not storage.ready:
+            try:
+                await db_executor.run(storage.start)
+                app.state.startup_error = None
+            except storage.errors + storage.busy_errors as e:
+                app.state.startup_error = str(e)
+                logger.warning("Database not ready, retrying in %ss: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+
+    # Startup does not wait for the database: the worker accepts requests at once, /ready
+    # reports when the schema is verified and the pool is warm, and requests arriving
+    # before that finish the start themselves
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        warm_up_task = asyncio.create_task(warm_up())
+        yield
+        warm_up_task.cancel()
+        db_executor.shutdown()
+        storage.close()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.storage = storage
+    app.state.db_executor = db_executor
+    app.state.response_cache = response_cache
+    app.state.startup_error = None
+
+    # Allow all origins (for development, consider restricting to specific origins in production)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3001"],
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE"],
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "Link", "ETag"],
+    )
+
+    def start_storage():
+        try:
+            storage.start()
+        except storage.errors + storage.busy_errors as e:
+            raise HTTPException(status_code=503, detail=f"Database not ready: {e}")
+
+    async def ensure_ready():
+        if not storage.ready:
+            await db_executor.run(start_storage)
+
+    @contextmanager
+    def database_errors():
+        """Turn driver errors raised in the block into HTTP errors"""
+        try:
+            yield
+        except storage.busy_errors as e:
+            raise HTTPException(status_code=503, detail=f"Database busy: {e}")
+        except storage.errors as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+    def translate_errors(func, *args):
+        """Call a storage method, turning driver errors into HTTP errors"""
+        with database_errors():
+            return func(*args)
+
+    async def run(func, *args):
+        await ensure_ready()
+        return await db_executor.run(translate_errors, func, *args)
+
+    async def write(func, *args):
+        """Call a storage write method; a write the storage queues is awaited here, not on a worker thread"""
+        future = await run(storage.submit, func, *args)
+        with database_errors():
+            return await asyncio.wrap_future(future)
+
+    async def cached(route, key, tags, func, *args):
+        """A read served from the response cache; on a miss it runs and is stored under tags(result)"""
+        if not response_cache.enabled:
+            return await run(func, *args)
+        hit, value = response_cache.get(route, key)
+        if hit:
+            return value
+        generation = response_cache.generation
+        value = await run(func, *args)
+        response_cache.put(route, key, value, tags(value), generation)
+        return value
+
+    async def invalidating(dataset_ids, func, *args):
+        """A write; cached responses of the datasets it touches are dropped once it finishes"""
+        try:
+            return await write(func, *args)
+        finally:
+            response_cache.invalidate(('dataset', dataset_id) for dataset_id in dataset_ids)
+
+    async def listing(iter_documents, model, request, response, project_id, limit, after, fields, *args,
+                      iter_json=None, paged=True):
+        """A listing of a project: a page of documents, or every row streamed as NDJSON
+
+        Tagged with the project's data version; a request naming the current tag gets a 304.
+        Only `paged` listings (not the single-item routes) advertise a next page.
+        When the storage builds JSON documents itself, `iter_json` replaces `iter_documents`
+        and its text is sent as is. `fields` limits the documents to a sparse fieldset.
+        """
+        fields = parse_fields(fields, model)
+        stream = wants_ndjson(request)
+        # A page of a paged listing fetches one row more, to know whether to advertise the next page
+        fetch = page_limit(limit) if paged else limit
+        version = await run(storage.project_version, project_id)
+        etag = project_etag(project_id, version, '.ndjson' if stream else '') if version is not None else None
+        if etag and etag_matches(request, etag):
+            return not_modified(etag)
+        if iter_json and storage.json_documents and fields is None:
+            if stream:
+                text = ndjson_text_response(iter_json(*args, limit, decode_cursor(after), stream=True))
+            else:
+                rows, more = split_page(await run(lambda: list(iter_json(*args, fetch, decode_cursor(after)))), limit)
+                text = json_text_response(rows)
+                set_next_cursor(request, text, rows, more)
+            if etag:
+                set_etag(text, etag)
+            return text
+        if stream:
+            streamed = ndjson_response(iter_documents(*args, limit, decode_cursor(after), stream=True, fields=fields),
+                                       sparse_model(model, fields) if fields else model)
+            if etag:
+                set_etag(streamed, etag)
+            return streamed
+        documents, more = split_page(
+            await run(lambda: list(iter_documents(*args, fetch, decode_cursor(after), fields=fields))), limit)
+        if fields:
+            response = sparse_response(documents, model, fields)
+        set_next_cursor(request, response, documents, more)
+        if etag:
+            set_etag(response, etag)
+        return response if fields else documents
+
+    # Readiness for load balancers and orchestrators: 503 until the database is usable
+    @app.get("/ready")
+    async def get_ready():
+        if storage.ready:
+            return {"status": "ready", "backend": storage.name}
+        return JSONResponse({"status": "starting", "backend": storage.name, "error": app.state.startup_error},
+                            status_code=503)
+
+    # Response cache size, hits and misses per route, and entries dropped by writes
+    @app.get("/cache_stats")
+    async def get_cache_stats():
+        return response_cache.stats()
+
+    @app.post("/add_raw_files/")
+    async def add_raw_files(raw_files: List[RawFileCreate]):
+        wanted = merge_raw_file_payload(raw_files)
+        counts = await invalidating({dataset_id for dataset_id, _ in wanted}, storage.add_raw_files, wanted)
+        return {"status": "success", "message": "Raw files and metadata added successfully", **counts}
+
+    # Route to fetch all patients and their metadata for a project_id
+    @app.get("/patients_metadata/{patient_id}", response_model=List[PatientWithSamples])
+    async def get_patients_metadata(project_id: int, patient_id: int, request: Request, response: Response,
+                                    limit: Optional[int] = LimitQuery, after: Optional[str] = AfterQuery,
+                                    fields: Optional[str] = FieldsQuery):
+        return await listing(storage.iter_patients_metadata, PatientWithSamples, request, response, project_id,
+                             limit, after, fields, project_id, patient_id,
+                             iter_json=storage.iter_patients_metadata_json, paged=patient_id == 0)
+
+    # Route to fetch all samples and metadata for a project_id and include patient information
+    @app.get("/samples/{sample_id}", response_model=List[Sample])
+    async def get_samples_per_patient(sample_id: int, project_id: int, request: Request, response: Response,
+                                      limit: Optional[int] = LimitQuery, after: Optional[str] = AfterQuery,
+                                      fields: Optional[str] = FieldsQuery):
+        return await listing(storage.iter_samples, Sample, request, response, project_id, limit, after, fields,
+                             sample_id, project_id, iter_json=storage.iter_samples_json, paged=sample_id == 0)
+
+    # Route to fetch all patients with sample counts; every patient_id lists the whole project
+    @app.get("/patients/{patient_id}", response_model=List[PatientWithSampleCount])
+    async def get_patients(project_id: int, patient_id: int, request: Request, response: Response,
+                           limit: Optional[int] = LimitQuery, after: Optional[str] = AfterQuery,
+                           fields: Optional[str] = FieldsQuery):
+        return await listing(storage.iter_patients, PatientWithSampleCount, request, response, project_id,
+                             limit, after, fields, project_id, patient_id)
+
+    # Route to fetch all projects and their statuses
+    @app.get("/projects/", response_model=List[Project])
+    async def get_projects():
+        return await cached("projects", (), lambda projects: (), storage.projects)
+
+    # Route to fetch all datasets
+    @app.get("/datasets/{dataset_id}", response_model=List[Dataset])
+    async def get_datasets(dataset_id: int, project_id: int):
+        return await cached("datasets", (dataset_id, project_id),
+                            lambda datasets: [('dataset', dataset['id']) for dataset in datasets],
+                            storage.datasets, dataset_id, project_id)
+
+    # Endpoint to fetch dataset details and metadata by dataset_id
+    @app.get("/datasets_with_metadata/{dataset_id}", response_model=DatasetWithMetadata)
+    async def get_dataset_with_metadata(dataset_id: int, project_id: int):
+        dataset = await cached("datasets_with_metadata", (dataset_id, project_id),
+                               lambda dataset: [('dataset', dataset_id)],
+                               storage.dataset_with_metadata, dataset_id, project_id)
+        if not dataset:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        return dataset
+
+    @app.get("/raw_files_with_metadata/{dataset_id}", response_model=List[RawFileResponse])
+    async def get_raw_files_with_metadata(dataset_id: int):
+        return await run(storage.raw_files_with_metadata, dataset_id)
+
+    async def upsert_dataset_metadata(items: List[DatasetMetadataUpsert]):
+        """Insert or update dataset metadata in one statement; rows that already hold the value are not rewritten"""
+        # Later entries for the same dataset and key win
+        latest = {(item.dataset_id, item.key): item.value for item in items}
+        written = await invalidating({dataset_id for dataset_id, _ in latest}, storage.upsert_dataset_metadata, latest)
+        return {"status": "success", "written": written, "unchanged": len(latest) - written}
+
+    # Set arbitrary metadata keys on one or many datasets
+    @app.put("/datasets_metadata/")
+    async def put_dataset_metadata(items: List[DatasetMetadataUpsert]):
+        return await upsert_dataset_metadata(items)
+
+    @app.put("/datasets_metadata/size_update", response_model=MetadataUpdate)
+    async def update_metadata(update: MetadataUpdate):
+        items = []
+        if update.raw_file_size:
+            items.append(DatasetMetadataUpsert(dataset_id=update.dataset_id, key='raw_file_extension_size_of_all_files', value=update.raw_file_size))
+        if update.last_size_update:
+            items.append(DatasetMetadataUpsert(dataset_id=update.dataset_id, key='last_size_update', value=update.last_size_update))
+        await upsert_dataset_metadata(items)
+        return update
+
+    return app
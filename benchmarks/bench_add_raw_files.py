@@ -0,0 +1,65 @@
+"""Throughput benchmark for POST /add_raw_files/.
+
+Posts batches of synthetic raw files (each with a few metadata entries) and
+reports files/sec for each batch size.
+
+    python benchmarks/bench_add_raw_files.py --sizes 100 1000 10000
+    python benchmarks/bench_add_raw_files.py --backend postgresql --dataset-id 1
+"""
+import argparse
+import importlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import populate_sqlite, raw_file_payload
+
+
+def load_app(args):
+    if args.backend == 'sqlite':
+        path = os.path.join(tempfile.mkdtemp(), 'bench_redmane.db')
+        os.environ['SQLITE_DATABASE'] = path
+        module = importlib.import_module('main')
+        module.storage.start()
+        conn = sqlite3.connect(path)
+        populate_sqlite(conn, patients=0, dataset_id=args.dataset_id)
+        conn.close()
+    else:
+        module = importlib.import_module('main_postgresql')
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure POST /add_raw_files/ throughput in files/sec.')
+    parser.add_argument('--backend', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--dataset-id', type=int, default=1)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--metadata-per-file', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    module = load_app(args)
+    from fastapi.testclient import TestClient
+
+    # Paths are unique per run so repeated runs against the same database never collide
+    run_tag = f"bench{int(time.time())}"
+    with TestClient(module.app) as client:
+        for size in args.sizes:
+            timings = []
+            for attempt in range(args.repeat):
+                payload = raw_file_payload(size, dataset_id=args.dataset_id,
+                                           prefix=f"{run_tag}_{size}_{attempt}",
+                                           metadata_per_file=args.metadata_per_file)
+                start = time.perf_counter()
+                client.post("/add_raw_files/", json=payload).raise_for_status()
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            print(f"{size:>8} files: {best * 1000:9.1f} ms  {size / best:12,.0f} files/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Cold-start time of a worker process, checked against a budget.
+
+Starts a fresh Python process per run, as an autoscaler would, and reports
+how long it takes to import the app, to start accepting requests (lifespan
+startup), to report ready on /ready (schema verified, pool warm) and to
+answer the first real request. Exits non-zero if the median time from
+process spawn to ready exceeds --budget-ms.
+
+    python benchmarks/bench_cold_start.py --runs 5 --budget-ms 2000
+    python benchmarks/bench_cold_start.py --backend postgresql
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from synthetic import populate_sqlite
+
+# Runs in the child process; its clock starts after the test client (not part of the app) is imported
+WORKER = '''
+import importlib, json, time
+from fastapi.testclient import TestClient
+start = time.perf_counter()
+module = importlib.import_module({module!r})
+imported = time.perf_counter()
+with TestClient(module.app) as client:
+    serving = time.perf_counter()
+    while client.get("/ready").status_code != 200:
+        time.sleep(0.005)
+    ready = time.perf_counter()
+    client.get("/projects/").raise_for_status()
+    first = time.perf_counter()
+    print(json.dumps({{
+        "import": imported - start,
+        "serving": serving - start,
+        "ready": ready - start,
+        "first_request": first - ready,
+    }}), flush=True)
+'''
+
+
+def prepare_sqlite(args):
+    """A database that has been initialised once, as a deployed one would be"""
+    import sqlite_db
+    from storage_sqlite import SQLiteStorage
+
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(dir=args.dir), 'cold_start.db'))
+    storage.start()
+    conn = sqlite_db.connect(storage.path)
+    populate_sqlite(conn, patients=100)
+    conn.close()
+    storage.close()
+    return {'SQLITE_DATABASE': storage.path}
+
+
+def cold_start(module, env):
+    spawned = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', WORKER.format(module=module)], cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()
+    spawn_to_ready = time.perf_counter() - spawned
+    process.wait()
+    if not line:
+        sys.exit(f"Worker exited with status {process.returncode} before becoming ready")
+    timings = json.loads(line)
+    # Interpreter start-up happens before the child's clock starts
+    timings['spawn_to_ready'] = spawn_to_ready
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure worker cold start against a time budget.')
+    parser.add_argument('--backend', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=2000, help='Allowed median time from spawn to ready')
+    parser.add_argument('--dir', help='Directory for the SQLite database (default: a temporary directory)')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.backend == 'sqlite':
+        env.update(prepare_sqlite(args))
+    module = 'main' if args.backend == 'sqlite' else 'main_postgresql'
+
+    runs = [cold_start(module, env) for _ in range(args.runs)]
+    print(f"{'phase (ms)':<16}{'median':>10}{'max':>10}")
+    for phase in ('import', 'serving', 'ready', 'first_request', 'spawn_to_ready'):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<16}{statistics.median(values):>10.1f}{max(values):>10.1f}")
+
+    median = statistics.median(run['spawn_to_ready'] * 1000 for run in runs)
+    print(f"spawn to ready {median:.0f} ms, budget {args.budget_ms:.0f} ms: {'ok' if median <= args.budget_ms else 'OVER BUDGET'}")
+    sys.exit(0 if median <= args.budget_ms else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Concurrency benchmark for the async routes.
+
+Fires N concurrent heavy requests (/samples/0 for a whole project) plus a
+light probe request (/projects/) and reports wall time and probe latency,
+once with queries dispatched to the database thread pool and once with the
+old behaviour of running them inline on the event loop.
+
+    python benchmarks/bench_concurrency.py --patients 2000 --concurrency 16
+    python benchmarks/bench_concurrency.py --backend postgresql --project-id 1
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import populate_sqlite
+
+
+def load_app(args):
+    # The probe must reach the database to show whether it waits behind the heavy requests
+    os.environ.setdefault('RESPONSE_CACHE_SIZE', '0')
+    if args.backend == 'sqlite':
+        path = os.path.join(tempfile.mkdtemp(), 'bench_redmane.db')
+        os.environ['SQLITE_DATABASE'] = path
+        module = importlib.import_module('main')
+        module.storage.start()
+        conn = sqlite3.connect(path)
+        populate_sqlite(conn, patients=args.patients, samples_per_patient=args.samples_per_patient,
+                        project_id=args.project_id)
+        conn.close()
+    else:
+        module = importlib.import_module('main_postgresql')
+    return module
+
+
+async def run_inline(func, *args, **kwargs):
+    """Pre-thread-pool behaviour: the blocking call runs on the event loop itself"""
+    return func(*args, **kwargs)
+
+
+async def burst(client, args):
+    heavy_url = f"/samples/0?project_id={args.project_id}"
+
+    async def probe():
+        response = await client.get("/projects/")
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    # The probe is scheduled after the heavy requests; its latency is how long a
+    # cheap request waits behind them
+    start = time.perf_counter()
+    results = await asyncio.gather(*[client.get(heavy_url) for _ in range(args.concurrency)], probe())
+    wall = time.perf_counter() - start
+    for response in results[:-1]:
+        response.raise_for_status()
+    return wall, results[-1]
+
+
+async def measure(module, mode, args):
+    executor = module.db_executor
+    original_run = executor.run
+    if mode == 'inline':
+        executor.run = run_inline
+    try:
+        async with module.app.router.lifespan_context(module.app):
+            transport = httpx.ASGITransport(app=module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                # Warm-up: one sequential request gives the single-request latency
+                start = time.perf_counter()
+                (await client.get(f"/samples/0?project_id={args.project_id}")).raise_for_status()
+                single = time.perf_counter() - start
+
+                walls, probes = [], []
+                for _ in range(args.repeat):
+                    wall, probe = await burst(client, args)
+                    walls.append(wall)
+                    probes.append(probe)
+    finally:
+        executor.run = original_run
+
+    wall = min(walls)
+    print(f"{mode:>8}: single request {single * 1000:8.1f} ms | "
+          f"{args.concurrency} concurrent {wall * 1000:8.1f} ms "
+          f"({wall / (single * args.concurrency):.2f}x of serialized) | "
+          f"probe latency {min(probes) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inline vs thread-pool database calls under concurrency.')
+    parser.add_argument('--backend', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--project-id', type=int, default=1)
+    parser.add_argument('--patients', type=int, default=2000, help='Synthetic patients (sqlite only)')
+    parser.add_argument('--samples-per-patient', type=int, default=3, help='Synthetic samples per patient (sqlite only)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    module = load_app(args)
+    for mode in ('inline', 'executor'):
+        asyncio.run(measure(module, mode, args))
+
+
+if __name__ == "__main__":
+    main()
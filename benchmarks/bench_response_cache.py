@@ -0,0 +1,93 @@
+"""Read throughput of the cached routes with and without the response cache.
+
+Sends `--requests` sequential requests spread over /projects/,
+/datasets/0, /datasets/{id} and /datasets_with_metadata/{id} for `--datasets`
+datasets on SQLite, with a /datasets_metadata/size_update write every
+`--write-every` requests, as the frontend and the tracker would. Prints
+requests per second for each cache size and the hit ratio the cache reached.
+
+    python benchmarks/bench_response_cache.py --requests 5000 --write-every 50
+    python benchmarks/bench_response_cache.py --sizes 0 16 256 --ttl 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from api import create_app
+from response_cache import ResponseCache
+from storage_sqlite import SQLiteStorage
+from synthetic import populate_sqlite
+
+
+def urls(args):
+    """The request sequence, the same for every cache size; None marks a write"""
+    rng = random.Random(0)
+    sequence = []
+    for i in range(1, args.requests + 1):
+        if args.write_every and i % args.write_every == 0:
+            sequence.append(None)
+            continue
+        dataset_id = rng.randint(1, args.datasets)
+        sequence.append(rng.choice([
+            "/projects/",
+            "/datasets/0?project_id=1",
+            f"/datasets/{dataset_id}?project_id=1",
+            f"/datasets_with_metadata/{dataset_id}?project_id=1",
+        ]))
+    return sequence
+
+
+async def measure(path, size, args):
+    cache = ResponseCache(max_size=size, ttl=args.ttl)
+    app = create_app(SQLiteStorage(path), response_cache=cache)
+    rng = random.Random(1)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            start = time.perf_counter()
+            for url in urls(args):
+                if url is None:
+                    response = await client.put("/datasets_metadata/size_update", json={
+                        "dataset_id": rng.randint(1, args.datasets), "raw_file_size": f"{rng.randint(1, 999)}MB",
+                        "last_size_update": "2025-01-01"})
+                else:
+                    response = await client.get(url)
+                response.raise_for_status()
+            elapsed = time.perf_counter() - start
+    return args.requests / elapsed, cache.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the response cache on the project and dataset routes.')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--datasets', type=int, default=50)
+    parser.add_argument('--write-every', type=int, default=50, help='Requests per metadata write; 0 for none')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 256], help='Cache sizes; 0 is no cache')
+    parser.add_argument('--ttl', type=float, default=30)
+    parser.add_argument('--dir', help='Directory for the database (default: a temporary directory)')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(dir=args.dir), 'bench_cache.db')
+    SQLiteStorage(path).init_db()
+    conn = sqlite3.connect(path)
+    for dataset_id in range(1, args.datasets + 1):
+        populate_sqlite(conn, patients=0, dataset_id=dataset_id)
+    conn.close()
+
+    print(f"{'size':>6}{'requests/s':>14}{'hit ratio':>12}{'invalidated':>14}")
+    for size in args.sizes:
+        rate, stats = asyncio.run(measure(path, size, args))
+        print(f"{size:>6}{rate:>14,.0f}{stats['hit_ratio']:>12.1%}{stats['invalidations']:>14,}")
+
+
+if __name__ == "__main__":
+    main()
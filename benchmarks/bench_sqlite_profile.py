@@ -0,0 +1,65 @@
+"""Read/write throughput of the SQLite backend with and without the
+connection performance profile (sqlite_db.PROFILE).
+
+Each profile gets a fresh synthetic database (journal_mode is stored in the
+file). The storage methods behind the routes are called directly, so HTTP
+overhead does not hide the difference: reads fetch one dataset with its
+metadata and one page of /samples/0, writes are single-key dataset metadata
+upserts, each its own committed transaction.
+
+    python benchmarks/bench_sqlite_profile.py --patients 2000 --requests 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sqlite_db
+from storage_sqlite import SQLiteStorage
+from synthetic import populate_sqlite
+
+PROFILES = {
+    'default': {},
+    'tuned': dict(sqlite_db.PROFILE),
+}
+
+
+def throughput(requests, operation):
+    start = time.perf_counter()
+    for i in range(requests):
+        operation(i)
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare SQLite throughput with and without the pragma profile.')
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--dir', help='Directory for the databases (default: a temporary directory); use a real disk to see fsync costs')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+
+    for name, profile in PROFILES.items():
+        sqlite_db.PROFILE = profile
+        storage = SQLiteStorage(os.path.join(workdir, f'bench_{name}.db'))
+        storage.init_db()
+        conn = sqlite_db.connect(storage.path)
+        populate_sqlite(conn, patients=args.patients)
+        conn.close()
+
+        reads = throughput(args.requests, lambda i: storage.dataset_with_metadata(1, 1))
+        pages = throughput(args.requests, lambda i: list(storage.iter_samples(
+            0, 1, args.page_size, i * args.page_size % (args.patients * 3))))
+        writes = throughput(args.requests, lambda i: storage.upsert_dataset_metadata(
+            {(1, f"bench_{i % 50}"): str(i)}))
+        storage.close()
+        print(f"{name:>8}: dataset reads {reads:9,.0f}/s | sample pages {pages:9,.0f}/s | writes {writes:9,.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
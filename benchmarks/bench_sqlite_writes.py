@@ -0,0 +1,88 @@
+"""Concurrent write throughput of the API on SQLite: group commit vs one transaction per write.
+
+`--concurrency` clients each send `--writes` small writes through the app
+(create_app), alternating POST /add_raw_files/ with one file and
+PUT /datasets_metadata/ with one key, the shape of concurrent tracker calls.
+Modes:
+
+    single   SQLITE_WRITE_BATCH=1: every write commits on its own, on a database worker thread
+    group    the GroupCommitWriter: writes queue for the writer thread and commit in batches
+
+Prints writes per second per mode and the batch sizes group commit reached.
+
+    python benchmarks/bench_sqlite_writes.py --concurrency 1 4 16 64 200
+    python benchmarks/bench_sqlite_writes.py --dir data --synchronous FULL
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sqlite_db
+from api import create_app
+from storage_sqlite import SQLiteStorage
+from synthetic import populate_sqlite
+
+
+async def client(http, name, writes):
+    for i in range(writes):
+        if i % 2:
+            response = await http.put("/datasets_metadata/", json=[
+                {"dataset_id": 1, "key": f"bench_{name}", "value": str(i)}])
+        else:
+            response = await http.post("/add_raw_files/", json=[
+                {"dataset_id": 1, "path": f"westn/raw/bench_{name}_{i}.fastq",
+                 "metadata": [{"metadata_key": "sample_id", "metadata_value": "1"}]}])
+        response.raise_for_status()
+
+
+async def run_mode(mode, path, concurrency, args):
+    storage = SQLiteStorage(path, write_batch=1 if mode == 'single' else args.write_batch)
+    app = create_app(storage, max_workers=args.workers)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            # Reach the database before timing, so startup is not counted
+            (await http.get("/projects/")).raise_for_status()
+            start = time.perf_counter()
+            await asyncio.gather(*(client(http, f"{mode}{concurrency}_{c}", args.writes) for c in range(concurrency)))
+            elapsed = time.perf_counter() - start
+        stats = storage.writer.stats() if storage.writer else None
+    return concurrency * args.writes / elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare API write throughput on SQLite with and without group commit.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64, 200])
+    parser.add_argument('--writes', type=int, default=20, help='Writes per client')
+    parser.add_argument('--write-batch', type=int, default=64, help='Largest group commit batch')
+    parser.add_argument('--workers', type=int, default=8, help='Database worker threads (DB_EXECUTOR_WORKERS)')
+    parser.add_argument('--synchronous', help='Override SQLITE_SYNCHRONOUS, e.g. FULL to pay an fsync per commit')
+    parser.add_argument('--dir', help='Directory for the database (default: a temporary directory); use a real disk to see fsync costs')
+    args = parser.parse_args()
+
+    if args.synchronous:
+        sqlite_db.PROFILE['synchronous'] = args.synchronous
+
+    path = os.path.join(tempfile.mkdtemp(dir=args.dir), 'bench_writes.db')
+    SQLiteStorage(path).init_db()
+    conn = sqlite_db.connect(path)
+    populate_sqlite(conn, patients=10)
+    conn.close()
+
+    print(f"{'clients':>8}{'single writes/s':>18}{'group writes/s':>18}{'avg batch':>12}{'largest batch':>15}")
+    for concurrency in args.concurrency:
+        single, _ = asyncio.run(run_mode('single', path, concurrency, args))
+        group, stats = asyncio.run(run_mode('group', path, concurrency, args))
+        print(f"{concurrency:>8}{single:>18,.0f}{group:>18,.0f}{stats['average_batch']:>12.1f}"
+              f"{stats['largest_batch']:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""The same workload against every storage backend, side by side.
+
+Calls the storage methods behind the routes directly (no HTTP), so the
+numbers compare the backends' queries rather than the web stack. Each
+operation is timed `--repeat` times and the best run is reported.
+
+    python benchmarks/bench_storage.py --patients 2000
+    python benchmarks/bench_storage.py --backends sqlite postgresql --populate --patients 2000
+    python benchmarks/bench_storage.py --backends sqlite sqlite-replica
+
+SQLite always runs on a fresh synthetic database; `sqlite-replica` serves the
+reads from an in-memory copy (SQLITE_MEMORY_REPLICA), so its writes include
+the refresh of that copy. PostgreSQL runs against the
+DB_* database: `--populate` first inserts a synthetic project of the same
+size (only use it on a scratch database), otherwise `--project-id` and
+`--dataset-id` pick existing data.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import populate_sqlite, populate_postgresql
+
+
+def sqlite_storage(args, replica=False):
+    import sqlite_db
+    from storage_sqlite import SQLiteStorage
+
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(dir=args.dir), 'bench_redmane.db'), replica=replica)
+    storage.start()
+    conn = sqlite_db.connect(storage.path)
+    populate_sqlite(conn, patients=args.patients)
+    conn.close()
+    if replica:
+        storage.pool.load()
+    return storage, 1, 1
+
+
+def sqlite_replica_storage(args):
+    return sqlite_storage(args, replica=True)
+
+
+def postgresql_storage(args):
+    import main_postgresql
+
+    storage = main_postgresql.storage
+    storage.start()
+    project_id, dataset_id = args.project_id, args.dataset_id
+    if args.populate:
+        with storage.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM projects")
+            project_id = dataset_id = cursor.fetchone()[0]
+            populate_postgresql(conn, patients=args.patients, project_id=project_id, dataset_id=dataset_id)
+            cursor.execute("ANALYZE")
+            conn.commit()
+    return storage, project_id, dataset_id
+
+
+BACKENDS = {'sqlite': sqlite_storage, 'sqlite-replica': sqlite_replica_storage, 'postgresql': postgresql_storage}
+
+
+def operations(storage, project_id, dataset_id, args):
+    # Paths are unique per run so repeated runs against the same database never collide
+    run_tag = f"bench{time.time_ns()}"
+    counter = iter(range(1_000_000))
+
+    def add_raw_files():
+        attempt = next(counter)
+        storage.add_raw_files({
+            (dataset_id, f"westn/raw/{run_tag}_{attempt}_{i:07d}.fastq"): {'key_0': str(i), 'key_1': run_tag}
+            for i in range(args.files)
+        })
+
+    def upsert_dataset_metadata():
+        attempt = next(counter)
+        storage.upsert_dataset_metadata({(dataset_id, f"bench_{k}"): f"{attempt}" for k in range(100)})
+
+    return [
+        ("dataset with metadata", lambda: storage.dataset_with_metadata(dataset_id, project_id)),
+        ("patients, page of 100", lambda: list(storage.iter_patients(project_id, 0, 100))),
+        ("patients_metadata, page of 100", lambda: list(storage.iter_patients_metadata(project_id, 0, 100))),
+        ("samples, page of 100", lambda: list(storage.iter_samples(0, project_id, 100))),
+        ("samples, whole project", lambda: list(storage.iter_samples(0, project_id))),
+        ("raw files with metadata", lambda: storage.raw_files_with_metadata(dataset_id)),
+        (f"add {args.files} raw files", add_raw_files),
+        ("upsert 100 dataset keys", upsert_dataset_metadata),
+    ]
+
+
+def best_time(operation, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one workload against each storage backend.')
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=['sqlite'])
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--files', type=int, default=1000, help='Raw files per add_raw_files call')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--populate', action='store_true', help='Insert a synthetic project (postgresql only)')
+    parser.add_argument('--project-id', type=int, default=1)
+    parser.add_argument('--dataset-id', type=int, default=1)
+    parser.add_argument('--dir', help='Directory for the SQLite database (default: a temporary directory)')
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends:
+        storage, project_id, dataset_id = BACKENDS[backend](args)
+        try:
+            for name, operation in operations(storage, project_id, dataset_id, args):
+                results.setdefault(name, {})[backend] = best_time(operation, args.repeat)
+        finally:
+            storage.close()
+
+    print(f"{'operation (best of ' + str(args.repeat) + ', ms)':<34}" + ''.join(f"{b:>16}" for b in args.backends))
+    for name, timings in results.items():
+        print(f"{name:<34}" + ''.join(f"{timings[b] * 1000:>16.2f}" for b in args.backends))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Checks the query plans behind every GET endpoint for sequential scans.
+
+Builds a large synthetic database spread over many projects, runs ANALYZE,
+requests each endpoint and EXPLAINs every statement it issues. Exits
+non-zero if any statement scans a whole table (or, on SQLite, has to build
+an automatic index), which means an index is missing.
+
+    python benchmarks/explain_check.py --patients 20000
+    python benchmarks/explain_check.py --backend postgresql --populate --patients 50000
+
+PostgreSQL statements are planned with enable_seqscan off, so a Seq Scan in
+the plan means no index can serve the query at all. The check runs against the DB_* database; `--populate` inserts
+synthetic projects into it, so only use it on a scratch database.
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import populate_sqlite, populate_postgresql
+
+ENDPOINTS = [
+    "/datasets/0?project_id={project_id}",
+    "/datasets/{dataset_id}?project_id={project_id}",
+    "/datasets_with_metadata/{dataset_id}?project_id={project_id}",
+    "/patients/0?project_id={project_id}",
+    "/patients/0?project_id={project_id}&limit=100",
+    "/patients_metadata/0?project_id={project_id}",
+    "/patients_metadata/0?project_id={project_id}&limit=100",
+    "/patients_metadata/{patient_id}?project_id={project_id}",
+    "/samples/0?project_id={project_id}",
+    "/samples/0?project_id={project_id}&limit=100",
+    "/samples/{sample_id}?project_id={project_id}",
+    "/raw_files_with_metadata/{dataset_id}",
+]
+
+# Listing every project is a whole-table read by design
+ALLOWED_SCANS = {'projects'}
+
+
+def sqlite_problems(plan_rows):
+    """Problems in EXPLAIN QUERY PLAN output: scans of real tables and automatic indexes"""
+    derived = set()
+    problems = []
+    for _, _, _, detail in plan_rows:
+        match = re.match(r'(?:CO-ROUTINE|MATERIALIZE) (\S+)', detail)
+        if match:
+            derived.add(match.group(1))
+            continue
+        if 'AUTOMATIC' in detail:
+            problems.append(detail)
+            continue
+        match = re.match(r'SCAN (\S+)', detail)
+        if match and 'VIRTUAL TABLE' not in detail and match.group(1) not in derived:
+            problems.append(detail)
+    return problems
+
+
+def check_sqlite(args):
+    from api import create_app
+    from storage_sqlite import SQLiteStorage
+
+    path = os.path.join(tempfile.mkdtemp(), 'explain_redmane.db')
+
+    statements = []
+    real_connect = sqlite3.connect
+
+    def traced_connect(*connect_args, **kwargs):
+        conn = real_connect(*connect_args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    storage = SQLiteStorage(path)
+    storage.init_db()
+    conn = real_connect(path)
+    per_project = args.patients // args.projects
+    for project_id in range(1, args.projects + 1):
+        populate_sqlite(conn, patients=per_project, project_id=project_id, dataset_id=project_id, seed=project_id)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+    def explain(sql):
+        return sqlite_problems(conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall())
+
+    sqlite3.connect = traced_connect
+    try:
+        return run_endpoints(create_app(storage), args, statements, explain)
+    finally:
+        sqlite3.connect = real_connect
+
+
+def postgresql_problems(plan, allowed=ALLOWED_SCANS):
+    problems = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') not in allowed:
+        problems.append(f"Seq Scan on {plan['Relation Name']}")
+    for child in plan.get('Plans', []):
+        problems.extend(postgresql_problems(child, allowed))
+    return problems
+
+
+def check_postgresql(args):
+    import main_postgresql as app_module
+    storage = app_module.storage
+    from psycopg2.extras import RealDictCursor
+
+    if args.populate:
+        with storage.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM projects")
+            first = cursor.fetchone()[0] + 1
+            per_project = args.patients // args.projects
+            for project_id in range(first, first + args.projects):
+                populate_postgresql(conn, patients=per_project, project_id=project_id, dataset_id=project_id)
+        args.project_id = args.dataset_id = first
+    with storage.pool.connection() as conn:
+        conn.autocommit = True
+        conn.cursor().execute("ANALYZE")
+        conn.autocommit = False
+
+    statements = []
+
+    class ExplainingCursor(RealDictCursor):
+        """Records the plan of each query (including EXECUTE of a prepared statement) before running it"""
+        def execute(self, query, vars=None):
+            if query.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH', 'EXECUTE'):
+                # A hash join over a seq scan can be the cheapest plan for a whole
+                # project, so plan with seq scans penalized: one left means no index fits
+                super().execute("SET enable_seqscan = off")
+                super().execute("EXPLAIN (FORMAT JSON) " + query, vars)
+                statements.append((self.mogrify(query, vars).decode(), self.fetchone()['QUERY PLAN'][0]['Plan']))
+                super().execute("RESET enable_seqscan")
+            return super().execute(query, vars)
+
+    storage.cursor = lambda conn: conn.cursor(cursor_factory=ExplainingCursor)
+    return run_endpoints(app_module.app, args, statements, lambda statement: postgresql_problems(statement[1]),
+                         describe=lambda statement: statement[0])
+
+
+def run_endpoints(app, args, statements, explain, describe=lambda statement: statement):
+    from fastapi.testclient import TestClient
+
+    ids = {'project_id': args.project_id, 'dataset_id': args.dataset_id}
+    failed = False
+    with TestClient(app) as client:
+        # Pick a patient and sample of the project under test
+        patients = client.get(f"/patients/0?project_id={args.project_id}&limit=1").json()
+        samples = client.get(f"/samples/0?project_id={args.project_id}&limit=1").json()
+        if not patients or not samples:
+            sys.exit(f"Project {args.project_id} has no patients or samples")
+        ids.update(patient_id=patients[0]['id'], sample_id=samples[0]['id'])
+
+        for endpoint in ENDPOINTS:
+            url = endpoint.format(**ids)
+            statements.clear()
+            client.get(url).raise_for_status()
+            for statement in statements:
+                text = describe(statement)
+                if text.lstrip().split(None, 1)[0].upper() not in ('SELECT', 'WITH', 'EXECUTE'):
+                    continue
+                problems = explain(statement)
+                failed |= bool(problems)
+                status = "FAIL" if problems else "ok"
+                print(f"{status:>4}  {url}\n      {' '.join(text.split())[:160]}")
+                for problem in problems:
+                    print(f"      -> {problem}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail if any endpoint query plan falls back to a sequential scan.')
+    parser.add_argument('--backend', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--patients', type=int, default=20000, help='Synthetic patients in total')
+    parser.add_argument('--projects', type=int, default=20, help='Projects the patients are spread over')
+    parser.add_argument('--project-id', type=int, default=1, help='Project whose endpoints are checked')
+    parser.add_argument('--dataset-id', type=int, default=1)
+    parser.add_argument('--populate', action='store_true', help='Insert synthetic data (postgresql only)')
+    args = parser.parse_args()
+
+    failed = check_sqlite(args) if args.backend == 'sqlite' else check_postgresql(args)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
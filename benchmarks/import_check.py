@@ -0,0 +1,144 @@
+"""Checks that CSV imports (sample_data/import_csv.py) leave the listings servable.
+
+Imports a small generated export of patients and samples into an empty
+project without --patient-url/--sample-url, then requests the project's
+patient and sample listings as JSON and NDJSON. It then re-imports the export
+with URLs and once more without, which must keep the URLs and report no rows
+updated. Exits non-zero if an import stored a value the response models
+reject or overwrote a URL.
+
+    python benchmarks/import_check.py
+    python benchmarks/import_check.py --backend postgresql --project-id 9001
+
+The PostgreSQL check writes a project to the DB_* database, so only use it
+on a scratch database.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'sample_data'))
+
+from synthetic import populate_sqlite, populate_postgresql
+from import_csv import import_csv
+
+# Listing and the number of documents it should return for `patients` imported patients
+LISTINGS = [
+    ("/patients/0?project_id={project_id}", 1),
+    ("/patients_metadata/0?project_id={project_id}", 1),
+    ("/samples/0?project_id={project_id}", 2),
+]
+
+
+def write_export(directory, patients):
+    """Patient and sample CSVs the way a REDCap export lays them out"""
+    patients_csv = os.path.join(directory, 'patients.csv')
+    samples_csv = os.path.join(directory, 'samples.csv')
+    with open(patients_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['record_id', 'age_range', 'smoking'])
+        writer.writerows([f"CHK{i:04d}", '40-49', 'no'] for i in range(patients))
+    with open(samples_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['record_id', 'sample_id', 'tissue'])
+        writer.writerows([f"CHK{i:04d}", f"CHK{i:04d}_{s}", 'Blood'] for i in range(patients) for s in range(2))
+    return patients_csv, samples_csv
+
+
+def open_app(args, directory):
+    """(app, storage) on an empty project `args.project_id`"""
+    if args.backend == 'postgresql':
+        import main_postgresql
+        main_postgresql.storage.start()
+        with main_postgresql.storage.connection() as conn:
+            populate_postgresql(conn, patients=0, project_id=args.project_id, dataset_id=args.project_id)
+            conn.commit()
+        return main_postgresql.app, main_postgresql.storage
+    from api import create_app
+    from storage_sqlite import SQLiteStorage
+    import sqlite_db
+    storage = SQLiteStorage(os.path.join(directory, 'import_check.db'))
+    storage.start()
+    conn = sqlite_db.connect(storage.path)
+    populate_sqlite(conn, patients=0, project_id=args.project_id, dataset_id=args.project_id)
+    conn.commit()
+    conn.close()
+    return create_app(storage), storage
+
+
+def count_documents(response):
+    if response.headers.get('content-type', '').startswith('application/x-ndjson'):
+        return len([json.loads(line) for line in response.text.splitlines()])
+    return len(response.json())
+
+
+def check_listings(client, project_id, patients):
+    failed = False
+    for listing, per_patient in LISTINGS:
+        url = listing.format(project_id=project_id)
+        for accept in ('application/json', 'application/x-ndjson'):
+            # A streamed response that fails midway still has a 200 status, so the documents are counted too
+            try:
+                response = client.get(url, headers={'Accept': accept})
+                documents = count_documents(response)
+                result = f"{response.status_code}, {documents} documents"
+                ok = response.status_code == 200 and documents == patients * per_patient
+            except Exception as e:
+                result, ok = f"{type(e).__name__}: {e}", False
+            failed |= not ok
+            print(f"{'ok' if ok else 'FAIL':>4}  {url} ({accept}): {result}")
+    return failed
+
+
+def check_reimport(client, project_id, counts, url):
+    """Fail unless a re-import without a URL updated nothing and every listed URL is still `url`"""
+    failed = False
+    for name, listing, field in (('patients', "/patients/0?project_id={project_id}", 'ext_patient_url'),
+                                 ('samples', "/samples/0?project_id={project_id}", 'ext_sample_url')):
+        try:
+            urls = sorted({document[field] for document in client.get(listing.format(project_id=project_id)).json()})
+        except ValueError as e:
+            urls = f"{type(e).__name__}: {e}"
+        ok = counts[name]['updated'] == 0 and urls == [url]
+        failed |= not ok
+        print(f"{'ok' if ok else 'FAIL':>4}  re-import of {name} without a URL: "
+              f"{counts[name]['updated']} updated, URLs {urls}")
+    return failed
+
+
+def import_export(storage, project_id, patients_csv, samples_csv, url=None):
+    return {
+        'patients': import_csv(storage, project_id, patients_csv, patient_url=url),
+        'samples': import_csv(storage, project_id, samples_csv, sample_column='sample_id', sample_url=url),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail if an import without URLs breaks the listings.')
+    parser.add_argument('--backend', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--project-id', type=int, default=1, help='Empty project to import into')
+    parser.add_argument('--patients', type=int, default=20)
+    args = parser.parse_args()
+
+    from fastapi.testclient import TestClient
+
+    directory = tempfile.mkdtemp()
+    patients_csv, samples_csv = write_export(directory, args.patients)
+    app, storage = open_app(args, directory)
+    with TestClient(app, raise_server_exceptions=False) as client:
+        import_export(storage, args.project_id, patients_csv, samples_csv)
+        failed = check_listings(client, args.project_id, args.patients)
+        url = 'https://redcap.example.org/record'
+        import_export(storage, args.project_id, patients_csv, samples_csv, url)
+        counts = import_export(storage, args.project_id, patients_csv, samples_csv)
+        failed |= check_reimport(client, args.project_id, counts, url)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Counts the SQL statements each listing endpoint issues against SQLite.
+
+Builds synthetic projects of increasing size and exits non-zero if any
+endpoint's statement count grows with the number of patients (an N+1 loop).
+
+    python benchmarks/query_counts.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import populate_sqlite
+
+ENDPOINTS = [
+    "/patients_metadata/0?project_id=1",
+    "/samples/0?project_id=1",
+    "/patients/0?project_id=1",
+    "/raw_files_with_metadata/1",
+]
+SIZES = [10, 100, 1000]
+
+
+def count_statements(client, url, statements):
+    statements.clear()
+    response = client.get(url)
+    response.raise_for_status()
+    return sum(1 for sql in statements if sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'))
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+
+    statements = []
+    real_connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = real_connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    sqlite3.connect = traced_connect
+
+    from api import create_app
+    from storage_sqlite import SQLiteStorage
+    from fastapi.testclient import TestClient
+
+    counts = {url: [] for url in ENDPOINTS}
+    for patients in SIZES:
+        path = os.path.join(workdir, f'redmane_{patients}.db')
+        storage = SQLiteStorage(path)
+        storage.init_db()
+        conn = real_connect(path)
+        populate_sqlite(conn, patients=patients)
+        conn.close()
+        with TestClient(create_app(storage)) as client:
+            for url in ENDPOINTS:
+                counts[url].append(count_statements(client, url, statements))
+
+    failed = False
+    print(f"{'endpoint':<40}" + ''.join(f"{n:>8}" for n in SIZES))
+    for url, values in counts.items():
+        grows = values[-1] > values[0]
+        failed |= grows
+        print(f"{url:<40}" + ''.join(f"{v:>8}" for v in values) + ("   <- grows with patients" if grows else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
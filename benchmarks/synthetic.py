@@ -0,0 +1,118 @@
+import random
+
+# Synthetic REDMANE data for benchmarks, shaped like the sample_data imports:
+# a project with patients, each with samples carrying a few metadata entries.
+
+SAMPLE_METADATA_KEYS = ['ext_sample_batch', 'tissue', 'sample_date']
+PATIENT_METADATA_KEYS = ['age_range', 'smoking', 'control']
+TISSUES = ['Liver', 'Lung', 'Blood', 'Skin', 'Bone']
+
+
+def populate_sqlite(conn, patients=1000, samples_per_patient=3, project_id=1, dataset_id=1, seed=0):
+    """Fill an initialised SQLite database with one project of synthetic patients and samples"""
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    cur.execute("INSERT OR IGNORE INTO projects (id, name, status) VALUES (?, ?, ?)",
+                (project_id, f"Synthetic project {project_id}", "active"))
+    cur.execute("INSERT OR IGNORE INTO datasets (id, project_id, name) VALUES (?, ?, ?)",
+                (dataset_id, project_id, f"Synthetic dataset {dataset_id}"))
+    cur.executemany("INSERT INTO datasets_metadata (dataset_id, key, value) VALUES (?, ?, ?)", [
+        (dataset_id, 'sample_info_stored', 'filename'),
+        (dataset_id, 'raw_file_extensions', '*.fastq'),
+    ])
+
+    for p in range(patients):
+        cur.execute("INSERT INTO patients (project_id, ext_patient_id, ext_patient_url) VALUES (?, ?, ?)",
+                    (project_id, f"SYN {p:06d}", "SYNTHETIC"))
+        patient_id = cur.lastrowid
+        cur.executemany("INSERT INTO patients_metadata (patient_id, key, value) VALUES (?, ?, ?)",
+                        [(patient_id, key, rng.choice(['yes', 'no'])) for key in PATIENT_METADATA_KEYS])
+        for s in range(samples_per_patient):
+            cur.execute("INSERT INTO samples (patient_id, ext_sample_id, ext_sample_url) VALUES (?, ?, ?)",
+                        (patient_id, f"syn{p:06d}_{s}", "SYNTHETIC"))
+            sample_id = cur.lastrowid
+            cur.executemany("INSERT INTO samples_metadata (sample_id, key, value) VALUES (?, ?, ?)", [
+                (sample_id, 'ext_sample_batch', str(rng.randint(1000, 9999))),
+                (sample_id, 'tissue', rng.choice(TISSUES)),
+                (sample_id, 'sample_date', f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"),
+            ])
+            cur.execute("INSERT INTO raw_files (dataset_id, path) VALUES (?, ?)",
+                        (dataset_id, f"westn/raw/syn{p:06d}_{s}_wes.fastq"))
+            cur.execute("INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value) VALUES (?, ?, ?)",
+                        (cur.lastrowid, 'sample_id', str(sample_id)))
+    conn.commit()
+
+
+def raw_file_payload(count, dataset_id=1, prefix="bench", metadata_per_file=2):
+    """JSON body for POST /add_raw_files/ with `count` distinct raw files"""
+    return [
+        {
+            "dataset_id": dataset_id,
+            "path": f"westn/raw/{prefix}_{i:07d}.fastq",
+            "metadata": [
+                {"metadata_key": f"key_{m}", "metadata_value": f"{prefix}_{i}_{m}"}
+                for m in range(metadata_per_file)
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+def populate_postgresql(conn, patients=1000, samples_per_patient=3, project_id=1, dataset_id=1):
+    """Same shape as populate_sqlite for the PostgreSQL schema, generated set-based on the server"""
+    cur = conn.cursor()
+    cur.execute("INSERT INTO projects (id, name, status) VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING",
+                (project_id, f"Synthetic project {project_id}", "active"))
+    cur.execute("INSERT INTO datasets (id, project_id, name) VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING",
+                (dataset_id, project_id, f"Synthetic dataset {dataset_id}"))
+    # Explicit ids bypass the sequences; move them past the rows just inserted
+    for table in ('projects', 'datasets'):
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+    cur.execute('''
+        INSERT INTO datasets_metadata (dataset_id, key, value)
+        VALUES (%s, 'sample_info_stored', 'filename'), (%s, 'raw_file_extensions', '*.fastq')
+        ON CONFLICT (dataset_id, key) DO NOTHING
+    ''', (dataset_id, dataset_id))
+
+    cur.execute('''
+        INSERT INTO patients (project_id, ext_patient_id, ext_patient_url)
+        SELECT %s, 'SYN ' || lpad(g::text, 6, '0'), 'SYNTHETIC'
+        FROM generate_series(0, %s - 1) AS g
+        RETURNING id
+    ''', (project_id, patients))
+    patient_ids = [row[0] for row in cur.fetchall()]
+    cur.execute('''
+        INSERT INTO patients_metadata (patient_id, key, value)
+        SELECT p, k, CASE WHEN (p + length(k)) %% 2 = 0 THEN 'yes' ELSE 'no' END
+        FROM unnest(%s::integer[]) AS p CROSS JOIN unnest(%s::text[]) AS k
+    ''', (patient_ids, PATIENT_METADATA_KEYS))
+
+    cur.execute('''
+        INSERT INTO samples (patient_id, ext_sample_id, ext_sample_url)
+        SELECT p, 'syn' || lpad(p::text, 6, '0') || '_' || s, 'SYNTHETIC'
+        FROM unnest(%s::integer[]) AS p CROSS JOIN generate_series(0, %s - 1) AS s
+        ORDER BY p, s
+        RETURNING id
+    ''', (patient_ids, samples_per_patient))
+    sample_ids = [row[0] for row in cur.fetchall()]
+    cur.execute('''
+        INSERT INTO samples_metadata (sample_id, key, value)
+        SELECT s, k, CASE k
+                 WHEN 'ext_sample_batch' THEN (1000 + s %% 9000)::text
+                 WHEN 'tissue' THEN (%s::text[])[1 + s %% 5]
+                 ELSE '2024-' || lpad((1 + s %% 12)::text, 2, '0') || '-' || lpad((1 + s %% 28)::text, 2, '0')
+               END
+        FROM unnest(%s::integer[]) AS s CROSS JOIN unnest(%s::text[]) AS k
+    ''', (TISSUES, sample_ids, SAMPLE_METADATA_KEYS))
+
+    cur.execute('''
+        WITH f AS (
+            INSERT INTO files (dataset_id, path, file_type)
+            SELECT %s, 'westn/raw/syn_' || s || '_wes.fastq', 'raw'
+            FROM unnest(%s::integer[]) AS s
+            RETURNING id, path
+        )
+        INSERT INTO files_metadata (raw_file_id, metadata_key, metadata_value)
+        SELECT id, 'sample_id', substring(path FROM 'syn_([0-9]+)_') FROM f
+    ''', (dataset_id, sample_ids))
+    conn.commit()
@@ -0,0 +1,33 @@
+from fastapi import Response
+
+# Conditional GETs for project listings. Every write to a project raises its
+# data version (projects.data_version, see storage.py), so the version alone
+# identifies the content of any listing of that project. It is sent as the
+# ETag; a client repeating the request with `If-None-Match` gets a 304 after a
+# single version lookup, before any rows are read or serialized.
+#
+# The version is read before the rows: a write committing in between makes
+# the rows newer than the tag, which only costs the client one more download.
+
+
+def project_etag(project_id, version, representation=''):
+    """Weak ETag of a project listing; `representation` keeps JSON and NDJSON bodies apart"""
+    return f'W/"{project_id}.{version}{representation}"'
+
+
+def etag_matches(request, etag):
+    """True when the request's If-None-Match names `etag` (compared weakly) or is *"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers={'ETag': etag, 'Vary': 'Accept'})
+
+
+def set_etag(response, etag):
+    response.headers['ETag'] = etag
+    response.headers['Vary'] = 'Accept'
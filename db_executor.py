@@ -0,0 +1,30 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DatabaseExecutor:
+    """Runs blocking database calls on a dedicated thread pool.
+
+    The sqlite3 and psycopg2 drivers block the calling thread for the whole
+    query. Routes await `run()` instead of calling them directly, so a slow
+    query occupies one worker thread rather than the event loop, and
+    concurrent requests overlap their database time.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+
+    async def run(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) on a database worker thread and await the result"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='db')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        """Wait for running calls and release the worker threads; the next run() starts new ones"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,48 @@
+import functools
+from typing import List
+
+from fastapi import HTTPException, Query, Response
+from pydantic import TypeAdapter, create_model
+
+# Sparse fieldsets for listing endpoints: `fields=id,ext_sample_id` returns only
+# those keys of each document. Nested lists and objects (metadata, patient,
+# samples) are fields too, and the storage only runs the join behind one when
+# it is named, so a light list view never touches the metadata tables.
+
+FieldsQuery = Query(None, description="Comma-separated fields to return, e.g. id,ext_sample_id; omit for every field")
+
+
+def parse_fields(value, model):
+    """The requested subset of `model`'s fields, or None when every field is wanted"""
+    if value is None:
+        return None
+    fields = frozenset(name.strip() for name in value.split(',') if name.strip())
+    unknown = fields - model.model_fields.keys()
+    if not fields or unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown)) or '(none given)'}; "
+                                                    f"available: {', '.join(model.model_fields)}")
+    return fields
+
+
+def wants(fields, name):
+    """Whether a listing asked for `name`; None asks for everything"""
+    return fields is None or name in fields
+
+
+@functools.lru_cache(maxsize=None)
+def sparse_model(model, fields):
+    """`model` cut down to `fields`, in the model's field order"""
+    return create_model(f"{model.__name__}Fields", **{
+        name: (info.annotation, info) for name, info in model.model_fields.items() if name in fields
+    })
+
+
+@functools.lru_cache(maxsize=None)
+def _list_adapter(model, fields):
+    return TypeAdapter(List[sparse_model(model, fields)])
+
+
+def sparse_response(documents, model, fields):
+    """A JSON array of the documents with only `fields` validated and serialized"""
+    adapter = _list_adapter(model, fields)
+    return Response(adapter.dump_json(adapter.validate_python(documents)), media_type='application/json')
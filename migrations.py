@@ -0,0 +1,298 @@
+# Versioned schema migrations, applied in order on startup by init_db.
+#
+# Each migration has a version, a description and the statements to run on
+# each backend. The applied version is kept in `PRAGMA user_version` on SQLite
+# and in the schema_migrations table on PostgreSQL; a migration runs in one
+# transaction together with the version bump, so a failed step is retried on
+# the next start. Never edit a released migration; append a new one.
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tables whose rows point at a patient or sample other than through metadata
+CHILDREN = {'patients': [('samples', 'patient_id')]}
+
+
+def merge_duplicates(table, owner_column, ext_column, metadata_table, metadata_owner, referencing_metadata=(),
+                     metadata_key='key'):
+    """Statements folding rows that repeat a natural key (owner, external id) into the first of them
+
+    Children and metadata move to the kept row; metadata keys the kept row
+    already has are dropped. `referencing_metadata` lists (table, key) pairs
+    whose values hold ids of `table` as text, such as a raw file's sample_id.
+    `metadata_key` names the key column of `metadata_table`.
+    """
+    merged = f"merged_{table}"
+    statements = [
+        f"""CREATE TEMP TABLE {merged} AS
+            SELECT t.id, k.keep_id
+            FROM {table} t
+            JOIN (SELECT {owner_column}, {ext_column}, MIN(id) AS keep_id
+                  FROM {table}
+                  WHERE {ext_column} IS NOT NULL
+                  GROUP BY {owner_column}, {ext_column}
+                  HAVING COUNT(*) > 1) k
+              ON t.{owner_column} = k.{owner_column} AND t.{ext_column} = k.{ext_column}
+            WHERE t.id <> k.keep_id""",
+        f"""DELETE FROM {metadata_table}
+            WHERE {metadata_owner} IN (SELECT id FROM {merged})
+              AND EXISTS (SELECT 1 FROM {merged} m
+                          JOIN {metadata_table} kept ON kept.{metadata_owner} = m.keep_id
+                          WHERE m.id = {metadata_table}.{metadata_owner}
+                            AND kept.{metadata_key} = {metadata_table}.{metadata_key})""",
+        f"""UPDATE {metadata_table}
+            SET {metadata_owner} = (SELECT keep_id FROM {merged} m WHERE m.id = {metadata_table}.{metadata_owner})
+            WHERE {metadata_owner} IN (SELECT id FROM {merged})""",
+    ]
+    for child_table, child_column in CHILDREN.get(table, ()):
+        statements.append(f"""UPDATE {child_table}
+            SET {child_column} = (SELECT keep_id FROM {merged} m WHERE m.id = {child_table}.{child_column})
+            WHERE {child_column} IN (SELECT id FROM {merged})""")
+    for reference_table, key in referencing_metadata:
+        statements.append(f"""UPDATE {reference_table}
+            SET metadata_value = (SELECT CAST(keep_id AS TEXT) FROM {merged} m
+                                  WHERE CAST(m.id AS TEXT) = {reference_table}.metadata_value)
+            WHERE metadata_key = '{key}' AND metadata_value IN (SELECT CAST(id AS TEXT) FROM {merged})""")
+    statements += [
+        f"DELETE FROM {table} WHERE id IN (SELECT id FROM {merged})",
+        f"DROP TABLE {merged}",
+    ]
+    return statements
+
+
+# patients.sample_count follows every change to samples. SQLite counts row by row;
+# PostgreSQL applies one aggregated update per statement from its transition
+# tables, so a bulk import costs one update per patient rather than per sample.
+SQLITE_SAMPLE_COUNT_TRIGGERS = [
+    """CREATE TRIGGER samples_count_insert AFTER INSERT ON samples
+       BEGIN
+           UPDATE patients SET sample_count = sample_count + 1 WHERE id = NEW.patient_id;
+       END""",
+    """CREATE TRIGGER samples_count_delete AFTER DELETE ON samples
+       BEGIN
+           UPDATE patients SET sample_count = sample_count - 1 WHERE id = OLD.patient_id;
+       END""",
+    """CREATE TRIGGER samples_count_move AFTER UPDATE OF patient_id ON samples
+       WHEN OLD.patient_id IS NOT NEW.patient_id
+       BEGIN
+           UPDATE patients SET sample_count = sample_count - 1 WHERE id = OLD.patient_id;
+           UPDATE patients SET sample_count = sample_count + 1 WHERE id = NEW.patient_id;
+       END""",
+]
+
+POSTGRESQL_SAMPLE_COUNT_TRIGGERS = [
+    """CREATE OR REPLACE FUNCTION count_samples() RETURNS trigger LANGUAGE plpgsql AS $$
+       BEGIN
+           IF TG_OP = 'TRUNCATE' THEN
+               UPDATE patients SET sample_count = 0 WHERE sample_count <> 0;
+           ELSIF TG_OP = 'INSERT' THEN
+               UPDATE patients p SET sample_count = p.sample_count + c.samples
+               FROM (SELECT patient_id, COUNT(*) AS samples FROM new_samples GROUP BY patient_id) c
+               WHERE p.id = c.patient_id;
+           ELSIF TG_OP = 'DELETE' THEN
+               UPDATE patients p SET sample_count = p.sample_count - c.samples
+               FROM (SELECT patient_id, COUNT(*) AS samples FROM old_samples GROUP BY patient_id) c
+               WHERE p.id = c.patient_id;
+           ELSE
+               UPDATE patients p SET sample_count = p.sample_count + c.samples
+               FROM (SELECT patient_id, SUM(change) AS samples
+                     FROM (SELECT patient_id, 1 AS change FROM new_samples
+                           UNION ALL
+                           SELECT patient_id, -1 FROM old_samples) changes
+                     GROUP BY patient_id
+                     HAVING SUM(change) <> 0) c
+               WHERE p.id = c.patient_id;
+           END IF;
+           RETURN NULL;
+       END
+       $$""",
+    """CREATE TRIGGER samples_count_insert AFTER INSERT ON samples
+       REFERENCING NEW TABLE AS new_samples
+       FOR EACH STATEMENT EXECUTE FUNCTION count_samples()""",
+    """CREATE TRIGGER samples_count_delete AFTER DELETE ON samples
+       REFERENCING OLD TABLE AS old_samples
+       FOR EACH STATEMENT EXECUTE FUNCTION count_samples()""",
+    # Transition tables rule out `UPDATE OF patient_id`; url updates net out to no change
+    """CREATE TRIGGER samples_count_move AFTER UPDATE ON samples
+       REFERENCING OLD TABLE AS old_samples NEW TABLE AS new_samples
+       FOR EACH STATEMENT EXECUTE FUNCTION count_samples()""",
+    """CREATE TRIGGER samples_count_truncate AFTER TRUNCATE ON samples
+       FOR EACH STATEMENT EXECUTE FUNCTION count_samples()""",
+]
+
+
+MIGRATIONS = [
+    (
+        1,
+        "Secondary indexes for the hot joins and keyset pages",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_datasets_project ON datasets (project_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_patients_project ON patients (project_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_patients_metadata_patient ON patients_metadata (patient_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_samples_patient ON samples (patient_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_samples_metadata_sample ON samples_metadata (sample_id, id)",
+            # Raw files are filtered on the sample_id key and joined back to samples by its value
+            "CREATE INDEX IF NOT EXISTS idx_raw_files_metadata_key_value ON raw_files_metadata (metadata_key, metadata_value)",
+        ],
+        [
+            "CREATE INDEX IF NOT EXISTS idx_datasets_project ON datasets (project_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_patients_project ON patients (project_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_patients_metadata_patient ON patients_metadata (patient_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_samples_patient ON samples (patient_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_samples_metadata_sample ON samples_metadata (sample_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_files_metadata_raw_file ON files_metadata (raw_file_id, metadata_key)",
+            "CREATE INDEX IF NOT EXISTS idx_files_metadata_key_value ON files_metadata (metadata_key, metadata_value)",
+        ],
+    ),
+    (
+        2,
+        "Unique natural keys for patients and samples, merging repeated imports",
+        # Patients first, so samples of merged patients are compared under their kept patient
+        merge_duplicates('patients', 'project_id', 'ext_patient_id', 'patients_metadata', 'patient_id')
+        + merge_duplicates('samples', 'patient_id', 'ext_sample_id', 'samples_metadata', 'sample_id',
+                           [('raw_files_metadata', 'sample_id')])
+        + [
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_patients_natural_key ON patients (project_id, ext_patient_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_samples_natural_key ON samples (patient_id, ext_sample_id)",
+        ],
+        merge_duplicates('patients', 'project_id', 'ext_patient_id', 'patients_metadata', 'patient_id')
+        + merge_duplicates('samples', 'patient_id', 'ext_sample_id', 'samples_metadata', 'sample_id',
+                           [('files_metadata', 'sample_id')])
+        + [
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_patients_natural_key ON patients (project_id, ext_patient_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_samples_natural_key ON samples (patient_id, ext_sample_id)",
+        ],
+    ),
+    (
+        3,
+        "Per-project data version for conditional GETs",
+        ["ALTER TABLE projects ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"],
+        ["ALTER TABLE projects ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0"],
+    ),
+    (
+        4,
+        "Sample counts maintained on patients",
+        [
+            "ALTER TABLE patients ADD COLUMN sample_count INTEGER NOT NULL DEFAULT 0",
+            "UPDATE patients SET sample_count = (SELECT COUNT(*) FROM samples WHERE samples.patient_id = patients.id)",
+        ] + SQLITE_SAMPLE_COUNT_TRIGGERS,
+        [
+            "ALTER TABLE patients ADD COLUMN IF NOT EXISTS sample_count INTEGER NOT NULL DEFAULT 0",
+            """UPDATE patients p SET sample_count = c.samples
+               FROM (SELECT patient_id, COUNT(*) AS samples FROM samples GROUP BY patient_id) c
+               WHERE p.id = c.patient_id""",
+        ] + POSTGRESQL_SAMPLE_COUNT_TRIGGERS,
+    ),
+    (
+        5,
+        "Unique keys for raw file paths and dataset metadata, merging repeated rows",
+        # Older databases could register a path twice (see merge_duplicates) and repeat a dataset
+        # metadata key; the first metadata row is kept, as the size update used to rewrite that one
+        merge_duplicates('raw_files', 'dataset_id', 'path', 'raw_files_metadata', 'raw_file_id',
+                         metadata_key='metadata_key')
+        + [
+            "DROP INDEX IF EXISTS idx_raw_files_dataset_path_nonunique",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_raw_files_dataset_path ON raw_files (dataset_id, path)",
+            "CREATE INDEX IF NOT EXISTS idx_raw_files_metadata_raw_file_id ON raw_files_metadata (raw_file_id, metadata_key)",
+            """DELETE FROM datasets_metadata
+               WHERE id NOT IN (SELECT MIN(id) FROM datasets_metadata GROUP BY dataset_id, key)""",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_datasets_metadata_dataset_key ON datasets_metadata (dataset_id, key)",
+        ],
+        # files is created with UNIQUE (dataset_id, path) by the public schema
+        [
+            """DELETE FROM datasets_metadata a
+               USING datasets_metadata b
+               WHERE a.dataset_id = b.dataset_id AND a.key = b.key AND a.id > b.id""",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_datasets_metadata_dataset_key ON datasets_metadata (dataset_id, key)",
+        ],
+    ),
+]
+
+# Schema version of a fully initialised database; init_db skips its checks when
+# the database is already at this version
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# pg_advisory_lock key serializing migrate_postgresql across connections
+MIGRATION_LOCK = 7263516
+
+
+def sqlite_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def postgresql_schema_version(conn):
+    """Applied schema version; 0 on a database that has never been migrated"""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cur.fetchone()[0]
+
+
+def migrate_sqlite(conn):
+    """Apply pending migrations to a SQLite connection; returns the resulting schema version"""
+    version = sqlite_schema_version(conn)
+    for target, description, sqlite_statements, _ in MIGRATIONS:
+        if target <= version:
+            continue
+        # sqlite3 does not open a transaction for DDL on its own. IMMEDIATE takes the write
+        # lock up front, so of several processes starting together only one applies it.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if sqlite_schema_version(conn) >= target:
+                conn.execute("COMMIT")
+                version = target
+                continue
+            logger.info("Applying migration %d: %s", target, description)
+            for statement in sqlite_statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        version = target
+    return version
+
+
+def migrate_postgresql(conn):
+    """Apply pending migrations to a psycopg2 connection; returns the resulting schema version
+
+    Workers starting together against the same database take turns: each
+    holds MIGRATION_LOCK while it reads the version and applies what is
+    pending, so the later ones find the migrations already applied.
+    """
+    cur = conn.cursor()
+    # A session lock, as each migration commits on its own
+    cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK,))
+    conn.commit()
+    try:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        ''')
+        conn.commit()
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        version = cur.fetchone()[0]
+        for target, description, _, postgresql_statements in MIGRATIONS:
+            if target <= version:
+                continue
+            logger.info("Applying migration %d: %s", target, description)
+            for statement in postgresql_statements:
+                cur.execute(statement)
+            cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                        (target, description))
+            conn.commit()
+            version = target
+    finally:
+        # Leave a failed migration's transaction first; the unlock cannot run inside it
+        conn.rollback()
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK,))
+        conn.commit()
+    return version
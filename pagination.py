@@ -0,0 +1,57 @@
+import base64
+import binascii
+
+from fastapi import HTTPException, Query
+
+# Keyset pagination for project-wide listings. Pages are ordered by primary
+# key; the opaque `after` cursor encodes the last id of the previous page, so
+# each page is an index range scan (`id > last_id ... LIMIT n`) rather than an
+# OFFSET that re-reads every earlier row.
+
+MAX_PAGE_SIZE = 10000
+
+# Largest id a cursor can carry; SQLite INTEGER and PostgreSQL bigint stop here
+MAX_CURSOR_ID = 2 ** 63 - 1
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+LimitQuery = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit to return every row")
+AfterQuery = Query(None, description="Cursor from the previous page's X-Next-Cursor header")
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the id to continue after; 0 (before every id) when no cursor is given"""
+    if not cursor:
+        return 0
+    try:
+        last_id = int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if not 0 <= last_id <= MAX_CURSOR_ID:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return last_id
+
+
+def page_limit(limit):
+    """Rows to fetch for a page of `limit`; the one extra row tells whether another page follows"""
+    return None if limit is None else limit + 1
+
+
+def split_page(items, limit):
+    """(page, more) from items fetched with page_limit(limit): the page, and whether the extra row came back"""
+    if limit is None or len(items) <= limit:
+        return items, False
+    return items[:limit], True
+
+
+def set_next_cursor(request, response, items, more):
+    """Advertise the page after `items` when there is one; the last page carries no cursor"""
+    if not more:
+        return
+    cursor = encode_cursor(items[-1]['id'])
+    response.headers[NEXT_CURSOR_HEADER] = cursor
+    response.headers['Link'] = f'<{request.url.include_query_params(after=cursor)}>; rel="next"'
@@ -0,0 +1,306 @@
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool.
+
+    Connections are health-checked on checkout, recycled when they have been
+    idle (or alive) for too long, and tracked while borrowed so that
+    connections which are never returned show up as leaks.
+    """
+
+    def __init__(self, min_size=1, max_size=10, timeout=30.0, max_idle=300.0,
+                 max_lifetime=3600.0, check_after_idle=5.0, leak_timeout=60.0,
+                 **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after_idle = check_after_idle
+        self.leak_timeout = leak_timeout
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []          # list of (conn, returned_at), most recently used last
+        self._in_use = {}        # id(conn) -> checkout info
+        self._created_at = {}    # id(conn) -> creation time
+        self._size = 0           # open connections, idle + in use
+        self._waiting = 0
+        self._opened = False
+        self._closed = False
+
+        self._counters = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'checkouts_waited': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'recycled_idle': 0,
+            'recycled_lifetime': 0,
+            'leaks_detected': 0,
+        }
+
+    # Connection lifecycle
+
+    def _register(self, conn):
+        self._created_at[id(conn)] = time.monotonic()
+        self._counters['connections_created'] += 1
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._counters['connections_closed'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _take_expired_idle(self, now):
+        """Remove connections idle for longer than max_idle from the pool, keeping min_size open.
+
+        Checkouts take the most recently used connection, so the expired ones
+        collect at the head of _idle. The caller holds the lock and closes the
+        returned connections after releasing it.
+        """
+        expired = []
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] > self.max_idle):
+            conn, _ = self._idle.pop(0)
+            self._created_at.pop(id(conn), None)
+            self._counters['connections_closed'] += 1
+            self._counters['recycled_idle'] += 1
+            self._size -= 1
+            expired.append(conn)
+        return expired
+
+    @staticmethod
+    def _close_all(conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.check_after_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def open(self):
+        """Fill the pool up to min_size connections"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Pool is closed")
+            self._opened = True
+            while self._size < self.min_size:
+                conn = psycopg2.connect(**self.connect_kwargs)
+                self._register(conn)
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+    def close(self):
+        """Close idle connections and refuse further checkouts"""
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            if self._in_use:
+                logger.warning("Closing pool with %d connection(s) still checked out", len(self._in_use))
+            self._cond.notify_all()
+
+    # Checkout / checkin
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        with self._cond:
+            expired = self._take_expired_idle(start)
+        self._close_all(expired)
+        while True:
+            conn = None
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Pool is closed")
+                if not self._opened:
+                    self.open()
+                self._report_leaks()
+
+                now = time.monotonic()
+                while self._idle:
+                    conn, returned_at = self._idle.pop()
+                    age = now - self._created_at.get(id(conn), now)
+                    if now - returned_at > self.max_idle:
+                        self._counters['recycled_idle'] += 1
+                    elif age > self.max_lifetime:
+                        self._counters['recycled_lifetime'] += 1
+                    else:
+                        break
+                    self._discard(conn)
+                    self._size -= 1
+                    conn = None
+
+                if conn is None:
+                    if self._size >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._counters['timeouts'] += 1
+                            raise PoolTimeout(
+                                f"No database connection available after {self.timeout:.1f}s "
+                                f"({self._size} open, {len(self._in_use)} in use)"
+                            )
+                        waited = True
+                        self._waiting += 1
+                        try:
+                            self._cond.wait(remaining)
+                        finally:
+                            self._waiting -= 1
+                        continue
+                    # Reserve the slot, then connect without holding the lock
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = psycopg2.connect(**self.connect_kwargs)
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._register(conn)
+                    return self._checkout(conn, start, waited)
+
+            # Health check outside the lock; a slow ping must not stall other checkouts
+            if self._is_healthy(conn, now - returned_at):
+                with self._cond:
+                    return self._checkout(conn, start, waited)
+            with self._cond:
+                self._counters['health_check_failures'] += 1
+                self._discard(conn)
+                self._size -= 1
+                self._cond.notify()
+
+    def _checkout(self, conn, start, waited):
+        now = time.monotonic()
+        wait_time = now - start
+        self._counters['checkouts'] += 1
+        if waited:
+            self._counters['checkouts_waited'] += 1
+        self._counters['wait_time_total'] += wait_time
+        self._counters['wait_time_max'] = max(self._counters['wait_time_max'], wait_time)
+        self._in_use[id(conn)] = {
+            'since': now,
+            # Only leak reports read the stack, and formatting it costs more than the checkout
+            'stack': ''.join(traceback.format_stack(limit=8)[:-2]) if self.leak_timeout else None,
+            'reported': False,
+        }
+        return conn
+
+    def putconn(self, conn):
+        # Roll back outside the lock; the round trip must not stall other checkouts
+        broken = conn.closed
+        if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        with self._cond:
+            if self._in_use.pop(id(conn), None) is None:
+                raise ValueError("Connection was not checked out from this pool")
+            if broken or self._closed:
+                self._discard(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            expired = self._take_expired_idle(time.monotonic())
+            self._cond.notify()
+        self._close_all(expired)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            self.putconn(conn)
+
+    # Observability
+
+    def _report_leaks(self):
+        if not self.leak_timeout:
+            return
+        now = time.monotonic()
+        for info in self._in_use.values():
+            if not info['reported'] and now - info['since'] > self.leak_timeout:
+                info['reported'] = True
+                self._counters['leaks_detected'] += 1
+                logger.warning(
+                    "Database connection checked out for %.1fs, possible leak. Checked out at:\n%s",
+                    now - info['since'], info['stack'],
+                )
+
+    def stats(self):
+        """Snapshot of pool utilization and wait times, used to size the pool"""
+        with self._cond:
+            self._report_leaks()
+            in_use = len(self._in_use)
+            checkouts = self._counters['checkouts']
+            now = time.monotonic()
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': in_use,
+                'waiting': self._waiting,
+                'utilization': in_use / self.max_size,
+                'longest_checkout_s': max((now - info['since'] for info in self._in_use.values()), default=0.0),
+                'checkouts': checkouts,
+                'checkouts_waited': self._counters['checkouts_waited'],
+                'wait_time_avg_ms': (self._counters['wait_time_total'] / checkouts * 1000) if checkouts else 0.0,
+                'wait_time_max_ms': self._counters['wait_time_max'] * 1000,
+                'timeouts': self._counters['timeouts'],
+                'connections_created': self._counters['connections_created'],
+                'connections_closed': self._counters['connections_closed'],
+                'recycled_idle': self._counters['recycled_idle'],
+                'recycled_lifetime': self._counters['recycled_lifetime'],
+                'health_check_failures': self._counters['health_check_failures'],
+                'leaks_detected': self._counters['leaks_detected'],
+            }
@@ -0,0 +1,81 @@
+import re
+import threading
+import weakref
+
+import psycopg2
+import psycopg2.errors
+
+
+class PreparedStatements:
+    """Registry of hot queries run as named prepared statements.
+
+    Queries are registered once by name with psycopg2-style `%s` placeholders.
+    The first time a pooled connection runs a query it is PREPAREd on that
+    connection's session (a miss); afterwards it is sent as EXECUTE, so
+    PostgreSQL skips parsing and can reuse its cached plan (a hit).
+    """
+
+    def __init__(self):
+        self._queries = {}  # name -> SQL with %s placeholders
+        self._prepared = weakref.WeakKeyDictionary()  # connection -> names prepared on its session
+        self._lock = threading.Lock()
+        self._counters = {}  # name -> {'hits': n, 'misses': n}
+
+    def register(self, name, sql):
+        if not re.fullmatch(r'[a-z_][a-z0-9_]*', name):
+            raise ValueError(f"Invalid statement name: {name!r}")
+        self._queries[name] = sql
+        self._counters[name] = {'hits': 0, 'misses': 0}
+
+    def _prepare(self, cursor, name):
+        placeholders = iter(range(1, self._queries[name].count('%s') + 1))
+        cursor.execute(f"PREPARE {name} AS " + re.sub(r'%s', lambda _: f"${next(placeholders)}", self._queries[name]))
+
+    def prepare_all(self, cursor):
+        """PREPARE every registered query not yet prepared on the cursor's connection, e.g. while pre-warming"""
+        with self._lock:
+            prepared = self._prepared.setdefault(cursor.connection, set())
+            pending = [name for name in self._queries if name not in prepared]
+        for name in pending:
+            self._prepare(cursor, name)
+            with self._lock:
+                prepared.add(name)
+
+    def sql(self, name):
+        """Plain SQL of a registered query, for cursors that cannot EXECUTE (server-side cursors)"""
+        return self._queries[name]
+
+    def execute(self, cursor, name, params=()):
+        conn = cursor.connection
+        with self._lock:
+            prepared = self._prepared.setdefault(conn, set())
+            hit = name in prepared
+            self._counters[name]['hits' if hit else 'misses'] += 1
+
+        try:
+            if not hit:
+                self._prepare(cursor, name)
+                with self._lock:
+                    prepared.add(name)
+            if params:
+                cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cursor.execute(f"EXECUTE {name}")
+        except psycopg2.errors.InvalidSqlStatementName:
+            # The session lost its prepared statements (e.g. DISCARD ALL); prepare again next time
+            with self._lock:
+                self._prepared.pop(conn, None)
+            raise
+
+    def stats(self):
+        with self._lock:
+            hits = sum(counter['hits'] for counter in self._counters.values())
+            misses = sum(counter['misses'] for counter in self._counters.values())
+            return {
+                'statements': len(self._queries),
+                'connections': len(self._prepared),
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+                'per_statement': {name: dict(counter) for name, counter in self._counters.items()},
+            }
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+# In-process cache of read responses that change only when an admin edits
+# them (projects, datasets). Entries are keyed by route and parameters, carry
+# tags such as ('dataset', 3), and leave the cache when they expire, when the
+# least recently used entry makes room for a new one, or when a write through
+# the API invalidates one of their tags. Each worker process has its own
+# cache, so writes made elsewhere (another worker, the import scripts) are
+# seen once the TTL has passed.
+
+
+class ResponseCache:
+    """Bounded LRU cache with a TTL and tag invalidation; a size or TTL of 0 disables it"""
+
+    def __init__(self, max_size=256, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (route, key) -> (expires, value, tags)
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a read that raced a write is not stored
+        self._generation = 0
+        self._counters = {}  # route -> {'hits': n, 'misses': n}
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, route, key):
+        """(True, value) for a fresh entry, (False, None) otherwise"""
+        with self._lock:
+            counter = self._counters.setdefault(route, {'hits': 0, 'misses': 0})
+            entry = self._entries.get((route, key))
+            if entry and entry[0] <= time.monotonic():
+                del self._entries[(route, key)]
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                counter['misses'] += 1
+                return False, None
+            self._entries.move_to_end((route, key))
+            counter['hits'] += 1
+            return True, entry[1]
+
+    def put(self, route, key, value, tags, generation):
+        """Store a value read while the cache was at `generation`; dropped if a write invalidated since"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[(route, key)] = (time.monotonic() + self.ttl, value, frozenset(tags))
+            self._entries.move_to_end((route, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, tags):
+        """Drop every entry carrying one of the tags"""
+        tags = set(tags)
+        with self._lock:
+            self._generation += 1
+            stale = [entry_key for entry_key, (_, _, entry_tags) in self._entries.items() if entry_tags & tags]
+            for entry_key in stale:
+                del self._entries[entry_key]
+            self._invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            hits = sum(counter['hits'] for counter in self._counters.values())
+            misses = sum(counter['misses'] for counter in self._counters.values())
+            return {
+                'enabled': self.enabled,
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'size': len(self._entries),
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+                'per_route': {route: dict(counter) for route, counter in self._counters.items()},
+            }
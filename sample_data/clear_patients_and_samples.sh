@@ -2,3 +2,5 @@
 
 sqlite3 ../data/data_redmane.db "delete from patients;"
 sqlite3 ../data/data_redmane.db "delete from samples;"
+# Changed outside the API: new data versions, so clients do not keep their cached listings
+sqlite3 ../data/data_redmane.db "update projects set data_version = data_version + 1;"
@@ -0,0 +1,149 @@
+"""Import patients or samples from a CSV export (e.g. REDCap) into either backend.
+
+The CSV is read as a stream and written in chunks of --chunk-size rows, one
+transaction per chunk, through the backend's bulk paths (executemany on
+SQLite, unnest and COPY on PostgreSQL), so memory use does not grow with the
+file. Rows are upserted by natural key, (project, ext_patient_id) or
+(patient, ext_sample_id): importing the same export again adds nothing, and
+a changed export only writes the rows and metadata values that changed.
+
+Every row is a patient, or a sample when --sample-column is given; samples are
+attached to the project's existing patients by --patient-column and rows whose
+patient is unknown are skipped. Metadata comes from the --metadata columns
+(COLUMN or COLUMN=KEY), by default every column that is not mapped otherwise.
+
+    # python import_csv.py 1 redcap_onj.csv --patient-url REDCAP-ONJ-443
+    # python import_csv.py 1 redcap_onj_samples.csv --sample-column sample_id --sample-url REDCAP-ONJ-443
+    # python import_csv.py 2 export.csv --metadata age_range diabetes_1=diabetes --backend postgresql
+"""
+import csv
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# SQLite database written to unless --database says otherwise
+DATABASE = os.getenv('SQLITE_DATABASE', os.path.join(ROOT, 'data', 'data_redmane.db'))
+
+# Rows per transaction: big enough that commits are rare, small enough that a failure loses little
+CHUNK_SIZE = 10000
+
+# Skipped rows reported one by one before only being counted
+SKIPPED_REPORT_LIMIT = 10
+
+
+def parse_metadata_columns(specs):
+    """[(column, key)] from COLUMN or COLUMN=KEY specs"""
+    columns = []
+    for spec in specs:
+        column, _, key = spec.partition('=')
+        columns.append((column, key or column))
+    return columns
+
+
+def open_storage(backend, database):
+    if backend == 'postgresql':
+        import main_postgresql
+        storage = main_postgresql.storage
+    else:
+        from storage_sqlite import SQLiteStorage
+        # A batch of 1 commits each chunk directly on this thread
+        storage = SQLiteStorage(database, write_batch=1)
+    storage.start()
+    return storage
+
+
+def import_csv(storage, project_id, csv_file, patient_column='record_id', patient_url=None,
+               sample_column=None, sample_url=None, metadata=None, chunk_size=CHUNK_SIZE):
+    """Stream csv_file into storage; returns the import counts of all chunks and the rows skipped"""
+    start = time.perf_counter()
+    patient_ids = storage.patient_ids(project_id) if sample_column else None
+    upsert = storage.import_samples if sample_column else storage.import_patients
+
+    imported = skipped = 0
+    counts = {}
+    chunk = []
+
+    def flush():
+        nonlocal imported
+        for name, count in upsert(chunk).items():
+            counts[name] = counts.get(name, 0) + count
+        imported += len(chunk)
+        chunk.clear()
+        elapsed = time.perf_counter() - start
+        print(f"{imported:,} rows committed ({counts['added']:,} added, {counts['updated']:,} updated), "
+              f"{imported / elapsed:,.0f} rows/s", flush=True)
+
+    with open(csv_file, newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        fieldnames = reader.fieldnames or []
+        mapped = {patient_column, sample_column}
+        if metadata is None:
+            metadata = [(column, column) for column in fieldnames if column not in mapped]
+        missing = [column for column in mapped | {column for column, _ in metadata}
+                   if column and column not in fieldnames]
+        if missing:
+            raise ValueError(f"Columns not in {csv_file}: {', '.join(sorted(missing))}")
+
+        for row in reader:
+            values = [(key, row[column]) for column, key in metadata]
+            if sample_column:
+                patient_id = patient_ids.get(row[patient_column])
+                if patient_id is None:
+                    skipped += 1
+                    if skipped <= SKIPPED_REPORT_LIMIT:
+                        print(f"No patient found with project_id '{project_id}' and {patient_column} "
+                              f"'{row[patient_column]}'. Skipping row.")
+                    continue
+                chunk.append((patient_id, row[sample_column], sample_url, values))
+            else:
+                chunk.append((project_id, row[patient_column], patient_url, values))
+
+            if len(chunk) >= chunk_size:
+                flush()
+
+    if chunk:
+        flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"Imported {imported:,} {'samples' if sample_column else 'patients'} in {elapsed:.2f}s "
+          f"({imported / elapsed if elapsed else 0:,.0f} rows/s): {counts.get('added', 0):,} added, "
+          f"{counts.get('updated', 0):,} updated, {counts.get('unchanged', 0):,} unchanged, {skipped:,} skipped")
+    counts['skipped'] = skipped
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import patients or samples from a CSV file.')
+    parser.add_argument('project_id', type=int, help='The project the patients belong to')
+    parser.add_argument('csv_file', type=str, help='The path to the CSV file to import')
+    parser.add_argument('--patient-column', default='record_id', help='Column holding ext_patient_id')
+    parser.add_argument('--patient-url', help='ext_patient_url of imported patients (default: empty)')
+    parser.add_argument('--sample-column', help='Column holding ext_sample_id; rows are imported as samples')
+    parser.add_argument('--sample-url', help='ext_sample_url of imported samples (default: empty)')
+    parser.add_argument('--metadata', nargs='+', metavar='COLUMN[=KEY]',
+                        help='Metadata columns (default: every column not mapped above)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows committed per transaction')
+    parser.add_argument('--backend', choices=['sqlite', 'postgresql'], default='sqlite',
+                        help='PostgreSQL is configured through the DB_* variables, as for main_postgresql.py')
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file')
+    args = parser.parse_args(argv)
+
+    storage = open_storage(args.backend, args.database)
+    try:
+        import_csv(storage, args.project_id, args.csv_file,
+                   patient_column=args.patient_column, patient_url=args.patient_url,
+                   sample_column=args.sample_column, sample_url=args.sample_url,
+                   metadata=parse_metadata_columns(args.metadata) if args.metadata else None,
+                   chunk_size=args.chunk_size)
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,26 @@
-import sqlite3
-import csv
 import argparse
 
-# Function to create SQLite tables if they do not exist
-def create_tables(cur):
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS patients (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        project_id TEXT NOT NULL,
-        ext_patient_id TEXT,
-        ext_patient_url TEXT,
-        public_patient_id TEXT
-    );
-    ''')
+from import_csv import CHUNK_SIZE, DATABASE, import_csv, open_storage
 
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS samples (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id INTEGER NOT NULL,
-        ext_sample_id TEXT,
-        ext_sample_url TEXT,
-        FOREIGN KEY (patient_id) REFERENCES patients(id)
-    );
-    ''')
-    
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS samples_metadata (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sample_id INTEGER NOT NULL,
-        key TEXT,
-        value TEXT,
-        FOREIGN KEY (sample_id) REFERENCES samples(id)
-    );
-    ''')
+# python import_onj_samples.py 1 REDCAP-ONJ-443 redcap_onj_samples.csv
 
-# Function to import data from CSV into SQLite tables
-def import_csv_to_sqlite(conn, project_id, ext_sample_url, csv_file):
-    cur = conn.cursor()
-
-    # Create tables if they do not exist
-    create_tables(cur)
-
-    # Open the CSV file and read its contents
-    with open(csv_file, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        
-        # Process each row in the CSV file
-        for row in reader:
-            # Fetch patient_id based on project_id and record_id (ext_patient_id)
-            cur.execute('''
-            SELECT id FROM patients WHERE project_id = ? AND ext_patient_id = ?
-            ''', (project_id, row['record_id']))
-            patient_id = cur.fetchone()
-            if patient_id:
-                patient_id = patient_id[0]
-            else:
-                print(f"No patient found with project_id '{project_id}' and record_id '{row['record_id']}'. Skipping row.")
-                continue
-
-            # Insert into samples table
-            cur.execute('''
-            INSERT INTO samples (patient_id, ext_sample_id, ext_sample_url)
-            VALUES (?, ?, ?)
-            ''', (patient_id, row['sample_id'], ext_sample_url))
-            
-            sample_id = cur.lastrowid
-            
-            # Insert into samples_metadata table
-            cur.execute('''
-            INSERT INTO samples_metadata (sample_id, key, value)
-            VALUES (?, ?, ?)
-            ''', (sample_id, 'ext_sample_batch', row['ext_sample_batch']))
-
-            cur.execute('''
-            INSERT INTO samples_metadata (sample_id, key, value)
-            VALUES (?, ?, ?)
-            ''', (sample_id, 'tissue', row['tissue']))
-            
-            cur.execute('''
-            INSERT INTO samples_metadata (sample_id, key, value)
-            VALUES (?, ?, ?)
-            ''', (sample_id, 'sample_date', row['sample_date']))
-
-    # Commit the transaction
-    conn.commit()
+# Metadata columns of this export; the rows are upserted by import_csv.py, so
+# importing the same file again adds nothing
+METADATA = ['ext_sample_batch', 'tissue', 'sample_date']
 
 # Main execution when running the script
 if __name__ == "__main__":
     # Command line argument parsing
     parser = argparse.ArgumentParser(description='Import CSV data into SQLite database.')
-    parser.add_argument('project_id', type=str, help='The project ID to use to find the patients')
+    parser.add_argument('project_id', type=int, help='The project ID to use to find the patients')
     parser.add_argument('ext_sample_url', type=str, help='The external sample URL to populate in samples')
     parser.add_argument('csv_file', type=str, help='The path to the CSV file to import')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows committed per transaction')
     args = parser.parse_args()
 
-    # Connect to the SQLite database (or create it if it doesn't exist)
-    conn = sqlite3.connect('../data/data_redmane.db')
-
-    # Call function to import data into SQLite tables
-    import_csv_to_sqlite(conn, args.project_id, args.ext_sample_url, args.csv_file)
-
-    # Close the database connection
-    conn.close()
-
+    storage = open_storage('sqlite', DATABASE)
+    try:
+        import_csv(storage, args.project_id, args.csv_file, sample_column='sample_id', sample_url=args.ext_sample_url,
+                   metadata=[(column, column) for column in METADATA], chunk_size=args.chunk_size)
+    finally:
+        storage.close()
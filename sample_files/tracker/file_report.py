@@ -48,28 +48,36 @@ def get_dataset_metadata(url):
 
     return result
 
-def get_sample_data(url):
+def get_sample_data(url, page_size=1000):
     """
     Fetch sample data from the given URL and extract ext_sample_id and patient_id.
+    The listing is walked one page at a time, following the X-Next-Cursor header.
     
     Args:
     url (str): The URL to fetch the sample data from.
+    page_size (int): The number of samples to request per page.
     
     Returns:
     list: A list of dictionaries containing ext_sample_id and patient_id.
     """
-    response = requests.get(url)
-    response.raise_for_status()  # Raise an error for bad status codes
-    samples = response.json()
-
     result = []
-    for sample in samples:
-        result.append({
-            "sample_id": sample["id"],
-            "patient_id": sample["patient_id"],
-            "ext_sample_id": sample["ext_sample_id"],
-            "ext_patient_id": sample["patient"]["ext_patient_id"]
-        })
+    params = {"limit": page_size}
+    while True:
+        response = requests.get(url, params=params)
+        response.raise_for_status()  # Raise an error for bad status codes
+
+        for sample in response.json():
+            result.append({
+                "sample_id": sample["id"],
+                "patient_id": sample["patient_id"],
+                "ext_sample_id": sample["ext_sample_id"],
+                "ext_patient_id": sample["patient"]["ext_patient_id"]
+            })
+
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        params["after"] = next_cursor
     
     return result
 
@@ -0,0 +1,487 @@
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Performance profile applied to every SQLite connection. WAL lets readers run
+# alongside a writer, synchronous=NORMAL only fsyncs at checkpoints (safe in
+# WAL mode; a power loss can drop the last commits but not corrupt the file),
+# and the page cache and memory map keep hot pages out of read() calls.
+PROFILE = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    # Negative cache_size is in KiB rather than pages
+    'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536)),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+    'temp_store': os.getenv('SQLITE_TEMP_STORE', 'MEMORY'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+}
+
+
+# One idle connection is kept open per database. journal_mode is stored in the
+# file, so it only needs setting when that connection is opened, and while it
+# is open the last request connection to close does not checkpoint and delete
+# the WAL (and the shared-memory index) on every request.
+_keepalive = {}
+_keepalive_lock = threading.Lock()
+
+
+def _pragmas(include_journal_mode):
+    return ''.join(
+        f"PRAGMA {pragma} = {value};" for pragma, value in PROFILE.items()
+        if pragma != 'journal_mode' or include_journal_mode
+    )
+
+
+def connect(path, read_only=False, **kwargs):
+    """Open a SQLite connection with PROFILE applied; keyword arguments go to sqlite3.connect
+
+    Read-only connections are opened with `mode=ro`, so a stray write fails
+    instead of taking the database write lock.
+    """
+    # sqlite3's own timeout would override busy_timeout, so derive it from the profile
+    kwargs.setdefault('timeout', PROFILE.get('busy_timeout', 5000) / 1000)
+    with _keepalive_lock:
+        if path not in _keepalive:
+            keepalive = sqlite3.connect(path, timeout=kwargs['timeout'], check_same_thread=False)
+            # Reading the schema attaches it to the WAL index, which is what keeps the WAL open
+            keepalive.executescript(_pragmas(include_journal_mode=True) + "SELECT 1 FROM sqlite_master LIMIT 1;")
+            _keepalive[path] = keepalive
+    if read_only:
+        conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True, **kwargs)
+    else:
+        conn = sqlite3.connect(path, **kwargs)
+    pragmas = _pragmas(include_journal_mode=False)
+    if pragmas:
+        conn.executescript(pragmas)
+    return conn
+
+
+def close_all():
+    """Close the kept-open connections, e.g. on application shutdown"""
+    with _keepalive_lock:
+        while _keepalive:
+            _keepalive.popitem()[1].close()
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class SQLitePool:
+    """Long-lived SQLite connections shared by the request threads.
+
+    Up to `readers` read-only connections serve queries concurrently (WAL lets
+    them run alongside a write), and a single writer connection serializes
+    writes in-process instead of having them queue on SQLite's file lock.
+    Connections are opened on first use and keep their page cache, parsed
+    schema and statement cache between requests.
+    """
+
+    def __init__(self, path, readers=4, timeout=30.0):
+        if readers < 1:
+            raise ValueError("An SQLite pool needs at least one reader")
+        self.path = path
+        self.readers = readers
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle_readers = []
+        self._reader_count = 0
+        self._writer = None
+        self._writer_busy = False
+
+    def _open(self, read_only):
+        # Connections move between the executor's threads (and streaming responses)
+        return connect(self.path, read_only=read_only, check_same_thread=False)
+
+    def getconn(self, write=False):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if write and not self._writer_busy:
+                    self._writer_busy = True
+                    conn = self._writer
+                    break
+                if not write and self._idle_readers:
+                    return self._idle_readers.pop()
+                if not write and self._reader_count < self.readers:
+                    self._reader_count += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No {'writer' if write else 'reader'} connection available within {self.timeout}s")
+                self._cond.wait(remaining)
+
+        if conn is not None:
+            return conn
+        # Open outside the lock; a failed open gives the slot back
+        try:
+            conn = self._open(read_only=not write)
+        except Exception:
+            with self._cond:
+                if write:
+                    self._writer_busy = False
+                else:
+                    self._reader_count -= 1
+                self._cond.notify()
+            raise
+        if write:
+            self._writer = conn
+        return conn
+
+    def putconn(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            if conn is self._writer:
+                self._writer_busy = False
+            else:
+                self._idle_readers.append(conn)
+            self._cond.notify_all()
+
+    def prewarm(self, readers):
+        """Open up to `readers` reader connections now rather than on the first requests"""
+        conns = [self.getconn() for _ in range(min(readers, self.readers))]
+        for conn in conns:
+            self.putconn(conn)
+
+    @contextmanager
+    def reader(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    @contextmanager
+    def writer(self):
+        conn = self.getconn(write=True)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def close(self):
+        """Close idle connections; the pool can be used again afterwards"""
+        with self._cond:
+            while self._idle_readers:
+                self._idle_readers.pop().close()
+                self._reader_count -= 1
+            if self._writer is not None and not self._writer_busy:
+                self._writer.close()
+                self._writer = None
+
+
+class ReplicaPool(SQLitePool):
+    """SQLitePool whose readers query an in-memory copy of the database.
+
+    The file is copied into a shared-cache in-memory database with the backup
+    API, and reader connections attach to that copy, so reads never touch the
+    disk. The writer connection still writes to the file. After a write,
+    refresh() builds a new copy and swaps it in atomically: new checkouts get
+    the new copy, connections to the old one are closed as they come back, and
+    the old copy is freed with its last connection. A background thread also
+    polls the file's data_version every `poll_interval` seconds and refreshes
+    when another process (the tracker, an importer) has committed.
+    """
+
+    _names = itertools.count()
+
+    def __init__(self, path, readers=4, timeout=30.0, poll_interval=5.0):
+        super().__init__(path, readers=readers, timeout=timeout)
+        self.poll_interval = poll_interval
+        self._name = f"redmane-replica-{os.getpid()}-{next(self._names)}"
+        self._generation = 0
+        self._generations = {}
+        # Holds the current copy open; an in-memory database lives as long as one connection to it
+        self._snapshot = None
+        self._source = None
+        self._data_version = None
+
+        self._refresh_cond = threading.Condition()
+        self._requested = 0
+        self._completed = 0
+        self._thread = None
+        self._closing = False
+        self._counters = {'refreshes': 0, 'failed_refreshes': 0, 'last_refresh_ms': 0.0}
+
+    def _uri(self, generation):
+        return f"file:{self._name}-{generation}?mode=memory&cache=shared"
+
+    def _open(self, read_only):
+        if not read_only:
+            return super()._open(read_only)
+        if self._snapshot is None:
+            self.load()
+        # Under the lock so the copy being attached to cannot be swapped out and freed meanwhile
+        with self._cond:
+            conn = sqlite3.connect(self._uri(self._generation), uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+            self._generations[conn] = self._generation
+        return conn
+
+    def putconn(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        stale = False
+        with self._cond:
+            if conn is self._writer:
+                self._writer_busy = False
+            elif self._generations.get(conn) == self._generation:
+                self._idle_readers.append(conn)
+            else:
+                # Attached to a copy that has since been replaced
+                self._generations.pop(conn, None)
+                self._reader_count -= 1
+                stale = True
+            self._cond.notify_all()
+        if stale:
+            conn.close()
+
+    def load(self):
+        """Copy the file into a new in-memory database and make it the one readers use"""
+        with self._refresh_cond:
+            start = time.perf_counter()
+            if self._source is None:
+                self._source = connect(self.path, read_only=True, check_same_thread=False)
+            generation = self._generation + 1
+            snapshot = sqlite3.connect(self._uri(generation), uri=True, check_same_thread=False)
+            try:
+                # Read before copying: a commit in between only causes one extra refresh
+                data_version = self._source.execute("PRAGMA data_version").fetchone()[0]
+                self._source.backup(snapshot)
+            except Exception:
+                snapshot.close()
+                raise
+
+            with self._cond:
+                previous, self._snapshot = self._snapshot, snapshot
+                self._generation = generation
+                self._data_version = data_version
+                stale, self._idle_readers = self._idle_readers, []
+                for conn in stale:
+                    self._generations.pop(conn, None)
+                self._reader_count -= len(stale)
+                self._cond.notify_all()
+            for conn in stale:
+                conn.close()
+            if previous is not None:
+                previous.close()
+
+            self._counters['refreshes'] += 1
+            self._counters['last_refresh_ms'] = (time.perf_counter() - start) * 1000
+
+    def prewarm(self, readers):
+        self.load()
+        with self._refresh_cond:
+            if self._thread is None:
+                self._closing = False
+                self._thread = threading.Thread(target=self._run, name='sqlite-replica', daemon=True)
+                self._thread.start()
+        super().prewarm(readers)
+
+    def refresh(self):
+        """Block until the copy includes everything committed before this call
+
+        Concurrent callers share one rebuild.
+        """
+        with self._refresh_cond:
+            if self._thread is None:
+                return
+            self._requested += 1
+            target = self._requested
+            self._refresh_cond.notify_all()
+            while self._completed < target and self._thread is not None:
+                self._refresh_cond.wait()
+
+    def _changed(self):
+        return self._source.execute("PRAGMA data_version").fetchone()[0] != self._data_version
+
+    def _run(self):
+        try:
+            while True:
+                with self._refresh_cond:
+                    if self._requested == self._completed and not self._closing:
+                        self._refresh_cond.wait(self.poll_interval)
+                    if self._closing:
+                        return
+                    target = self._requested
+                    try:
+                        if target > self._completed or self._changed():
+                            self.load()
+                    except sqlite3.Error as e:
+                        # Readers keep the previous copy; the next write or poll tries again
+                        self._counters['failed_refreshes'] += 1
+                        logger.warning("In-memory replica refresh failed: %s", e)
+                    except Exception:
+                        self._counters['failed_refreshes'] += 1
+                        logger.exception("In-memory replica refresh failed")
+                    self._completed = max(self._completed, target)
+                    self._refresh_cond.notify_all()
+        finally:
+            # Should the thread still die, refresh() must not wait for it: without a
+            # thread it returns at once and readers keep the copy they have
+            with self._refresh_cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                self._refresh_cond.notify_all()
+
+    def close(self):
+        """Stop refreshing and close the idle connections and the copy; the pool can be used again afterwards"""
+        with self._refresh_cond:
+            thread, self._thread = self._thread, None
+            self._closing = True
+            self._refresh_cond.notify_all()
+        if thread is not None:
+            thread.join()
+        with self._cond:
+            for conn in self._idle_readers:
+                self._generations.pop(conn, None)
+        super().close()
+        with self._cond:
+            if self._snapshot is not None:
+                self._snapshot.close()
+                self._snapshot = None
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def stats(self):
+        with self._refresh_cond:
+            counters = dict(self._counters)
+        with self._cond:
+            counters['generation'] = self._generation
+            counters['pending'] = self._requested - self._completed
+            if self._snapshot is not None:
+                page_count = self._snapshot.execute("PRAGMA page_count").fetchone()[0]
+                page_size = self._snapshot.execute("PRAGMA page_size").fetchone()[0]
+                counters['size_bytes'] = page_count * page_size
+        return counters
+
+
+class GroupCommitWriter:
+    """Runs all writes on one thread and commits whatever is queued together.
+
+    Callers submit a function taking the writer connection and get a Future
+    that completes once the transaction containing it has committed, so no
+    caller thread has to wait for the commit. The thread takes every pending
+    write (up to `max_batch`), runs each in its own savepoint inside a single
+    BEGIN IMMEDIATE transaction and commits once, so N concurrent writes cost
+    one lock acquisition and one commit instead of N. A write that raises is
+    rolled back to its savepoint and its caller gets the exception; the rest
+    of the batch still commits. A write whose Future was cancelled before its
+    batch started is skipped. `on_commit` runs after each commit, before the
+    batch's Futures complete; if it raises, the error is logged and the
+    Futures complete all the same, since the batch is committed.
+    """
+
+    def __init__(self, pool, max_batch=64, on_commit=None):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.on_commit = on_commit
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = {'writes': 0, 'failed_writes': 0, 'batches': 0, 'failed_batches': 0, 'largest_batch': 0}
+
+    def submit(self, func, *args):
+        """Run func(conn, *args) in the next batch; returns a Future of its result, set once the batch has committed"""
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+            self._queue.put((func, args, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Everything that queued up while the previous batch committed goes into this one
+            while len(batch) < self.max_batch and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    # Keep the thread alive: writes queued after this batch would never complete otherwise
+                    logger.exception("SQLite group commit failed")
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        # Once running, a Future can no longer be cancelled under the writer
+        batch = [(func, args, future) for func, args, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            with self.pool.writer() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for func, args, future in batch:
+                    conn.execute("SAVEPOINT batched_write")
+                    try:
+                        outcomes.append((future, func(conn, *args), None))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO batched_write")
+                        outcomes.append((future, None, e))
+                    conn.execute("RELEASE batched_write")
+                conn.commit()
+        except Exception as e:
+            # BEGIN, a savepoint or COMMIT failed: nothing in the batch was written
+            with self._lock:
+                self._counters['failed_batches'] += 1
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        if self.on_commit:
+            try:
+                self.on_commit()
+            except Exception:
+                logger.exception("on_commit failed after a group commit")
+        with self._lock:
+            self._counters['batches'] += 1
+            self._counters['writes'] += len(batch)
+            self._counters['failed_writes'] += sum(1 for _, _, error in outcomes if error)
+            self._counters['largest_batch'] = max(self._counters['largest_batch'], len(batch))
+        for future, result, error in outcomes:
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """Commit what is queued and stop the thread; the next submit() starts a new one"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['pending'] = self._queue.qsize()
+        counters['average_batch'] = counters['writes'] / counters['batches'] if counters['batches'] else 0.0
+        return counters
@@ -0,0 +1,398 @@
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+from fieldsets import wants
+
+# Storage engine interface behind the API (api.py). Each backend implements
+# the same queries with its own fast paths; the routes, models, pagination and
+# streaming are shared.
+#
+# Listing methods are generators yielding one JSON-ready document at a time,
+# so a route can either collect a page or stream rows as they are read. Their
+# `fields` (see fieldsets.py) names the document keys the caller will send;
+# nested lists and objects it leaves out may be omitted, and their joins skipped.
+# Methods raise the driver's own exceptions; `errors` and `busy_errors` tell
+# the API which of them mean a failed query (500) or an exhausted pool (503).
+
+
+class Storage:
+    """Base class of the storage backends; every query method must be overridden"""
+
+    name = None
+    errors = ()
+    busy_errors = ()
+    # Worker threads for blocking calls; more than the backend can run at once would only queue
+    max_workers = 8
+
+    def __init__(self):
+        self.ready = False
+        self._start_lock = threading.Lock()
+
+    def init_db(self):
+        """Create or upgrade the schema; cheap when the database is already up to date"""
+        raise NotImplementedError
+
+    def prewarm(self):
+        """Open connections ahead of the first requests"""
+
+    def start(self):
+        """Verify the schema and pre-warm connections, once per process
+
+        Nothing touches the database before this runs, so a worker boots
+        without waiting on it. A failure leaves the storage not ready and the
+        next call tries again.
+        """
+        if self.ready:
+            return
+        with self._start_lock:
+            if not self.ready:
+                self.init_db()
+                self.prewarm()
+                self.ready = True
+
+    def close(self):
+        """Called on application shutdown; release connections"""
+
+    def projects(self):
+        raise NotImplementedError
+
+    def datasets(self, dataset_id: int, project_id: int):
+        """Datasets of a project; one dataset when dataset_id is not 0"""
+        raise NotImplementedError
+
+    def dataset_with_metadata(self, dataset_id: int, project_id: int):
+        """A dataset document with its metadata, or None when it does not exist"""
+        raise NotImplementedError
+
+    def iter_patients(self, project_id: int, patient_id: int, limit: Optional[int] = None, after: int = 0,
+                      stream: bool = False, fields: Optional[frozenset] = None):
+        """Patients with sample counts, in id order; `stream` asks for rows to be read incrementally"""
+        raise NotImplementedError
+
+    def iter_patients_metadata(self, project_id: int, patient_id: int, limit: Optional[int] = None, after: int = 0,
+                               stream: bool = False, fields: Optional[frozenset] = None):
+        """Patients with their metadata and samples; one patient when patient_id is not 0"""
+        raise NotImplementedError
+
+    def iter_samples(self, sample_id: int, project_id: int, limit: Optional[int] = None, after: int = 0,
+                     stream: bool = False, fields: Optional[frozenset] = None):
+        """Samples with their metadata and patient; one sample when sample_id is not 0"""
+        raise NotImplementedError
+
+    # Backends that can build the nested listing documents as JSON text themselves set
+    # json_documents; the API then sends that text without rebuilding or validating it
+
+    json_documents = False
+
+    def iter_patients_metadata_json(self, project_id: int, patient_id: int, limit: Optional[int] = None,
+                                    after: int = 0, stream: bool = False):
+        """As iter_patients_metadata, yielding {'id': patient id, 'document': JSON text} rows"""
+        raise NotImplementedError
+
+    def iter_samples_json(self, sample_id: int, project_id: int, limit: Optional[int] = None, after: int = 0,
+                          stream: bool = False):
+        """As iter_samples, yielding {'id': sample id, 'document': JSON text} rows"""
+        raise NotImplementedError
+
+    def raw_files_with_metadata(self, dataset_id: int):
+        """Raw files of a dataset with the sample they belong to and its metadata"""
+        raise NotImplementedError
+
+    def submit(self, write, *args):
+        """Start write(*args), one of the write methods below; returns a concurrent.futures.Future of its result
+
+        Runs it on the calling thread. A backend that commits on a thread of its
+        own only queues it, so the caller does not hold a thread while it waits.
+        """
+        future = Future()
+        try:
+            future.set_result(write(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def add_raw_files(self, wanted):
+        """Upsert files and metadata given as {(dataset_id, path): {key: value}}; returns the counts"""
+        raise NotImplementedError
+
+    def upsert_dataset_metadata(self, latest):
+        """Write {(dataset_id, key): value}, skipping unchanged values; returns the rows written"""
+        raise NotImplementedError
+
+    # Every write that changes a project's rows raises projects.data_version in the same
+    # transaction; the API hands it out as the ETag of the project's listings
+
+    def project_version(self, project_id: int):
+        """The project's data version, or None when it does not exist"""
+        raise NotImplementedError
+
+    # Bulk import (sample_data/import_csv.py). Each call is one transaction that upserts
+    # by natural key and writes only what changed; it returns the counts. A url of None
+    # means none was supplied: new rows get an empty one (see new_row_url) and existing
+    # rows keep theirs.
+
+    def patient_ids(self, project_id: int):
+        """{ext_patient_id: id} for a project"""
+        raise NotImplementedError
+
+    def import_patients(self, rows):
+        """Upsert (project_id, ext_patient_id, ext_patient_url, [(key, value), ...]) rows"""
+        raise NotImplementedError
+
+    def import_samples(self, rows):
+        """Upsert (patient_id, ext_sample_id, ext_sample_url, [(key, value), ...]) rows"""
+        raise NotImplementedError
+
+
+def merge_raw_file_payload(raw_files):
+    """Collapse the payload to {(dataset_id, path): {key: value}}; later entries win"""
+    wanted = {}
+    for raw_file in raw_files:
+        metadata = wanted.setdefault((raw_file.dataset_id, raw_file.path), {})
+        for item in raw_file.metadata or []:
+            metadata[item.metadata_key] = item.metadata_value
+    return wanted
+
+
+def diff_metadata(wanted, ids, existing):
+    """Split the wanted metadata into (owner id, key, value) rows to insert and to update
+
+    `wanted` maps a natural key (such as (dataset_id, path)) to {key: value},
+    `ids` maps the same natural keys to row ids and `existing` maps row ids to
+    {key: set of stored values}; keys whose stored value already matches are
+    left alone, and stored keys missing from `wanted` are kept.
+    """
+    inserts, updates = [], []
+    for natural_key, metadata in wanted.items():
+        owner_id = ids[natural_key]
+        stored = existing.get(owner_id, {})
+        for key, value in metadata.items():
+            if key not in stored:
+                inserts.append((owner_id, key, value))
+            elif stored[key] != {value}:
+                updates.append((owner_id, key, value))
+    return inserts, updates
+
+
+def bump_project_versions_sql(owner_table, ids):
+    """UPDATE raising data_version of the projects that own the `owner_table` rows selected by `ids`"""
+    if owner_table != 'projects':
+        ids = f"SELECT project_id FROM {owner_table} WHERE id IN ({ids})"
+    return f"UPDATE projects SET data_version = data_version + 1 WHERE id IN ({ids})"
+
+
+# Imported tables: (owner column, external id column, url column, metadata table,
+# metadata owner column). The owner and external id form the natural key.
+IMPORT_TABLES = {
+    'patients': ('project_id', 'ext_patient_id', 'ext_patient_url', 'patients_metadata', 'patient_id'),
+    'samples': ('patient_id', 'ext_sample_id', 'ext_sample_url', 'samples_metadata', 'sample_id'),
+}
+
+# Table the owner column of an imported table points at
+IMPORT_OWNER_TABLES = {'patients': 'projects', 'samples': 'patients'}
+
+
+def import_counts(found, added, url_updated_ids, inserts, updates):
+    """Counts reported by an import; `found` maps the natural keys that already existed to (id, url)"""
+    existing_ids = {row_id for row_id, _ in found.values()}
+    changed = existing_ids & (set(url_updated_ids)
+                              | {owner_id for owner_id, _, _ in inserts} | {owner_id for owner_id, _, _ in updates})
+    return {
+        "added": added,
+        "updated": len(changed),
+        "unchanged": len(existing_ids) - len(changed),
+        "metadata_added": len(inserts),
+        "metadata_updated": len(updates),
+    }
+
+
+def new_row_url(url):
+    """URL stored on a newly imported row; the response models require a string"""
+    return '' if url is None else url
+
+
+def merge_import_rows(rows):
+    """Collapse (owner, ext_id, url, [(key, value), ...]) rows to {(owner, ext_id): (url, {key: value})}; later rows win"""
+    wanted = {}
+    for owner, ext_id, url, metadata in rows:
+        _, merged = wanted.get((owner, ext_id), (None, {}))
+        merged.update(metadata)
+        wanted[(owner, ext_id)] = (url, merged)
+    return wanted
+
+
+# Rows a patient or sample listing covers, as a subquery the listing SQL below is built
+# around: one item by id, or a keyset page (id > after) of a project. {p} stands for
+# the driver's placeholder, '?' on sqlite3 and '%s' on psycopg2.
+PATIENT_SELECTIONS = (
+    'SELECT id FROM patients WHERE project_id = {p} AND id = {p}',
+    'SELECT id FROM patients WHERE project_id = {p} AND id > {p} ORDER BY id LIMIT {p}',
+)
+
+SAMPLE_SELECTIONS = (
+    """SELECT s.id, s.patient_id, s.ext_sample_id, s.ext_sample_url
+          FROM samples s
+          JOIN patients p ON s.patient_id = p.id
+          WHERE p.project_id = {p} AND s.id = {p}""",
+    """SELECT s.id, s.patient_id, s.ext_sample_id, s.ext_sample_url
+          FROM samples s
+          JOIN patients p ON s.patient_id = p.id
+          WHERE p.project_id = {p} AND s.id > {p}
+          ORDER BY s.id
+          LIMIT {p}""",
+)
+
+
+def select_listing(selections, item_id, project_id, limit, after, placeholder):
+    """(subquery, params) of the item when item_id is not 0, else of the page after `after`"""
+    by_id, page = selections
+    if item_id != 0:
+        return by_id.format(p=placeholder), (project_id, item_id)
+    return page.format(p=placeholder), (project_id, after, limit)
+
+
+def patient_rows_sql(selected, with_metadata=True):
+    """Rows for group_patient_rows: the patients whose ids `selected` returns, with their metadata unless left out"""
+    if not with_metadata:
+        return f'''
+    SELECT id, project_id, ext_patient_id, ext_patient_url, public_patient_id
+    FROM patients
+    WHERE id IN ({selected})
+    ORDER BY id
+'''
+    return f'''
+    SELECT p.id, p.project_id, p.ext_patient_id, p.ext_patient_url, p.public_patient_id,
+           pm.id AS metadata_id, pm.key AS metadata_key, pm.value AS metadata_value
+    FROM patients p
+    LEFT JOIN patients_metadata pm ON p.id = pm.patient_id
+    WHERE p.id IN ({selected})
+    ORDER BY p.id
+'''
+
+
+def patient_samples_sql(selected):
+    """Rows for group_sample_rows: the samples and their metadata of the patients whose ids `selected` returns"""
+    return f'''
+    SELECT s.id AS sample_id, s.patient_id, s.ext_sample_id, s.ext_sample_url,
+           sm.id AS metadata_id, sm.key AS metadata_key, sm.value AS metadata_value
+    FROM samples s
+    LEFT JOIN samples_metadata sm ON s.id = sm.sample_id
+    WHERE s.patient_id IN ({selected})
+    ORDER BY s.patient_id, s.id, sm.id
+'''
+
+
+def patients_with_samples(query, selected, params, fields=None):
+    """Patient documents of the `selected` patients, with their metadata and samples unless `fields` leaves them out
+
+    Patients and samples are read from two queries ordered by patient id and
+    merged as rows arrive; query(name, sql, params) runs one and returns its
+    rows, `name` naming the cursor for backends that stream.
+    """
+    with_metadata = wants(fields, 'metadata')
+    patients = group_patient_rows(query('patients_metadata', patient_rows_sql(selected, with_metadata), params),
+                                  with_metadata=with_metadata)
+    if not wants(fields, 'samples'):
+        return patients
+    samples = group_sample_rows(query('patients_metadata_samples', patient_samples_sql(selected), params))
+    return merge_patient_samples(patients, samples)
+
+
+def sample_rows_sql(selected, with_metadata=True, with_patient=True):
+    """Rows for group_sample_rows: the samples of the `selected` subquery, with their metadata and patient unless left out"""
+    columns = ['s.id AS sample_id', 's.patient_id', 's.ext_sample_id', 's.ext_sample_url']
+    joins = []
+    order = ['s.id']
+    if with_metadata:
+        columns += ['sm.id AS metadata_id', 'sm.key AS metadata_key', 'sm.value AS metadata_value']
+        joins.append('LEFT JOIN samples_metadata sm ON s.id = sm.sample_id')
+        order.append('sm.id')
+    if with_patient:
+        columns += ['p.project_id', 'p.ext_patient_id', 'p.ext_patient_url', 'p.public_patient_id']
+        joins.append('LEFT JOIN patients p ON s.patient_id = p.id')
+    return f'''
+    SELECT {', '.join(columns)}
+    FROM ({selected}) s
+    {' '.join(joins)}
+    ORDER BY {', '.join(order)}
+'''
+
+
+# Fold patient rows (patient columns + one metadata entry per row), ordered by
+# patient id, into one patient document per patient. Rows are accessed by
+# column name, so the backends alias their columns alike; without
+# with_metadata the rows carry no metadata columns.
+def group_patient_rows(rows, with_metadata=True):
+    current_patient = None
+    for row in rows:
+        if not current_patient or current_patient['id'] != row['id']:
+            if current_patient:
+                yield current_patient
+            current_patient = {
+                'id': row['id'],
+                'project_id': row['project_id'],
+                'ext_patient_id': row['ext_patient_id'],
+                'ext_patient_url': row['ext_patient_url'],
+                'public_patient_id': row['public_patient_id'],
+                'samples': [],
+                'metadata': []
+            }
+
+        if with_metadata and row['metadata_id']:
+            current_patient['metadata'].append({
+                'id': row['metadata_id'],
+                'patient_id': row['id'],
+                'key': row['metadata_key'],
+                'value': row['metadata_value']
+            })
+
+    if current_patient:
+        yield current_patient
+
+
+# Fold sample rows (sample columns + one metadata entry per row unless
+# with_metadata is off, and the patient columns when with_patient is set),
+# ordered by sample id, into one sample document per sample
+def group_sample_rows(rows, with_patient=False, with_metadata=True):
+    current_sample = None
+    for row in rows:
+        if not current_sample or current_sample['id'] != row['sample_id']:
+            if current_sample:
+                yield current_sample
+            current_sample = {
+                'id': row['sample_id'],
+                'patient_id': row['patient_id'],
+                'ext_sample_id': row['ext_sample_id'],
+                'ext_sample_url': row['ext_sample_url'],
+                'metadata': []
+            }
+            if with_patient:
+                current_sample['patient'] = {
+                    'id': row['patient_id'],
+                    'project_id': row['project_id'],
+                    'ext_patient_id': row['ext_patient_id'],
+                    'ext_patient_url': row['ext_patient_url'],
+                    'public_patient_id': row['public_patient_id']
+                }
+
+        if with_metadata and row['metadata_id']:  # Check if metadata exists
+            current_sample['metadata'].append({
+                'id': row['metadata_id'],
+                'sample_id': row['sample_id'],
+                'key': row['metadata_key'],
+                'value': row['metadata_value']
+            })
+
+    if current_sample:
+        yield current_sample
+
+
+def merge_patient_samples(patients, samples):
+    """Attach samples to patients; both iterables are ordered by patient id"""
+    next_sample = next(samples, None)
+    for patient in patients:
+        while next_sample and next_sample['patient_id'] == patient['id']:
+            patient['samples'].append(next_sample)
+            next_sample = next(samples, None)
+        yield patient
@@ -0,0 +1,510 @@
+import csv
+import io
+import os
+from contextlib import contextmanager
+from typing import Optional
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from migrations import LATEST_VERSION, migrate_postgresql, postgresql_schema_version
+from pg_pool import ConnectionPool, PoolTimeout
+from fieldsets import wants
+from pg_statements import PreparedStatements
+from storage import (Storage, IMPORT_TABLES, IMPORT_OWNER_TABLES, PATIENT_SELECTIONS, SAMPLE_SELECTIONS,
+                     bump_project_versions_sql, diff_metadata, group_sample_rows, import_counts, merge_import_rows,
+                     new_row_url, patients_with_samples, sample_rows_sql, select_listing)
+
+# Rows fetched per round trip by server-side cursors
+STREAM_ITERSIZE = int(os.getenv('DB_STREAM_ITERSIZE', 2000))
+
+# Ids passed to bump_project_versions_sql as one integer array parameter
+ARRAY_IDS = "SELECT unnest(%s::integer[])"
+
+# Files per batch; each batch is a fixed handful of round trips however many files it holds
+BULK_INSERT_BATCH_SIZE = int(os.getenv('DB_BULK_INSERT_BATCH_SIZE', 5000))
+
+# Hot queries, prepared once per pooled connection and then run by name
+statements = PreparedStatements()
+
+# Complete sample documents are prepared; sparse fieldsets run their cut-down query unprepared
+statements.register('sample_by_id', sample_rows_sql(SAMPLE_SELECTIONS[0].format(p='%s')))
+statements.register('project_samples', sample_rows_sql(SAMPLE_SELECTIONS[1].format(p='%s')))
+
+# Sample counts are kept on patients by triggers (migration 4)
+statements.register('project_patients_sample_counts', '''
+    SELECT id, project_id, ext_patient_id, ext_patient_url, public_patient_id, sample_count
+    FROM patients
+    WHERE project_id = %s AND id > %s
+    ORDER BY id
+    LIMIT %s
+''')
+
+# Checked by every conditional GET of a project listing
+statements.register('project_version', '''
+    SELECT data_version FROM projects WHERE id = %s
+''')
+
+statements.register('dataset_by_id', '''
+    SELECT id, project_id, name
+    FROM datasets
+    WHERE id = %s AND project_id = %s
+''')
+
+statements.register('dataset_metadata', '''
+    SELECT id, dataset_id, key, value
+    FROM datasets_metadata
+    WHERE dataset_id = %s
+    ORDER BY id
+''')
+
+
+# JSON document mode (DB_JSON_DOCUMENTS): PostgreSQL nests the listing documents
+# itself, one row and one JSON text per patient or sample, with the keys in the
+# order of the response models. json_build_object keeps that order (jsonb
+# would not), and each metadata list is one json_agg over an index range.
+METADATA_JSON = '''COALESCE((SELECT json_agg(json_build_object('id', m.id, '{owner}', m.{owner}, 'key', m.key,
+                                                 'value', m.value) ORDER BY m.id)
+                  FROM {table} m WHERE m.{owner} = {alias}.id), '[]')'''
+
+PATIENT_FIELDS = '''
+    'id', p.id, 'project_id', p.project_id, 'ext_patient_id', p.ext_patient_id,
+    'ext_patient_url', p.ext_patient_url, 'public_patient_id', p.public_patient_id'''
+
+SAMPLE_FIELDS = f'''
+    'id', s.id, 'patient_id', s.patient_id, 'ext_sample_id', s.ext_sample_id, 'ext_sample_url', s.ext_sample_url,
+    'metadata', {METADATA_JSON.format(table='samples_metadata', owner='sample_id', alias='s')}'''
+
+# A sample with its metadata and patient, as the Sample model
+SAMPLES_JSON = f'''
+    SELECT s.id, json_build_object({SAMPLE_FIELDS},
+                                   'patient', json_build_object({PATIENT_FIELDS}))::text AS document
+    FROM samples s
+    JOIN patients p ON s.patient_id = p.id
+'''
+
+# A patient with its metadata and its samples with theirs, as the PatientWithSamples model
+PATIENTS_JSON = f'''
+    SELECT p.id, json_build_object({PATIENT_FIELDS},
+        'metadata', {METADATA_JSON.format(table='patients_metadata', owner='patient_id', alias='p')},
+        'samples', COALESCE((SELECT json_agg(json_build_object({SAMPLE_FIELDS}) ORDER BY s.id)
+                             FROM samples s WHERE s.patient_id = p.id), '[]'))::text AS document
+    FROM patients p
+'''
+
+statements.register('sample_by_id_json', SAMPLES_JSON + 'WHERE p.project_id = %s AND s.id = %s')
+statements.register('project_samples_json', SAMPLES_JSON + '''
+    WHERE p.project_id = %s AND s.id > %s
+    ORDER BY s.id
+    LIMIT %s
+''')
+statements.register('patient_by_id_json', PATIENTS_JSON + 'WHERE p.project_id = %s AND p.id = %s')
+statements.register('project_patients_json', PATIENTS_JSON + '''
+    WHERE p.project_id = %s AND p.id > %s
+    ORDER BY p.id
+    LIMIT %s
+''')
+
+
+def execute_statement(cursor, name, params=()):
+    """Run a registered query; server-side cursors cannot EXECUTE, so they get the plain SQL"""
+    if cursor.name:
+        cursor.execute(statements.sql(name), params)
+    else:
+        statements.execute(cursor, name, params)
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Bulk-load rows with COPY, which skips per-row parameter handling and planning"""
+    buffer = io.StringIO()
+    # Quoted strings keep '' distinct from NULL, which CSV writes as an empty field
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def select_file_ids(cursor, file_keys):
+    cursor.execute('''
+        SELECT f.id, f.dataset_id, f.path
+        FROM files f
+        JOIN unnest(%s::integer[], %s::text[]) AS k(dataset_id, path)
+          ON f.dataset_id = k.dataset_id AND f.path = k.path
+    ''', ([dataset_id for dataset_id, _ in file_keys], [path for _, path in file_keys]))
+    return {(row['dataset_id'], row['path']): row['id'] for row in cursor.fetchall()}
+
+
+class PostgreSQLStorage(Storage):
+    """Storage on PostgreSQL.
+
+    Hot queries run as prepared statements, id lists travel as arrays
+    (`= ANY(%s)`, `unnest`) instead of one statement per row, bulk metadata
+    goes in through COPY, and streamed listings read from server-side cursors.
+
+    With `json_documents=True` the patient and sample listings are built as
+    nested JSON by PostgreSQL and passed through by the API as text.
+    """
+
+    name = 'postgresql'
+    errors = (psycopg2.Error,)
+    busy_errors = (PoolTimeout,)
+
+    def __init__(self, database_config, pool_config, json_documents=False):
+        super().__init__()
+        self.pool = ConnectionPool(**pool_config, **database_config)
+        self.json_documents = json_documents
+        # More workers than pooled connections would only wait on the pool
+        self.max_workers = pool_config.get('max_size', 10)
+
+    def prewarm(self):
+        """Open min_size connections and prepare the hot queries on each"""
+        self.pool.open()
+        conns = [self.pool.getconn() for _ in range(self.pool.min_size)]
+        try:
+            for conn in conns:
+                statements.prepare_all(conn.cursor())
+                conn.commit()
+        finally:
+            for conn in conns:
+                self.pool.putconn(conn)
+
+    def close(self):
+        self.pool.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool for the duration of a with-block"""
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    def cursor(self, conn):
+        """Get PostgreSQL database cursor with RealDictCursor for named access"""
+        return conn.cursor(cursor_factory=RealDictCursor)
+
+    def stream_cursor(self, conn, name):
+        """Get a named (server-side) RealDictCursor; rows are fetched in batches of STREAM_ITERSIZE while iterating"""
+        cursor = conn.cursor(name=name, cursor_factory=RealDictCursor)
+        cursor.itersize = STREAM_ITERSIZE
+        return cursor
+
+    def init_db(self):
+        """Initialize PostgreSQL database - tables should already exist from schema import"""
+        with self.connection() as conn:
+            # An up-to-date database only costs the version lookup; the checks below run before a migration
+            if postgresql_schema_version(conn) < LATEST_VERSION:
+                self._check_schema(conn)
+            conn.commit()
+
+    def _check_schema(self, conn):
+        cur = self.cursor(conn)
+
+        # Since we imported the schema, tables should already exist
+        # We can verify by checking if tables exist
+        cur.execute("""
+            SELECT table_name
+            FROM information_schema.tables
+            WHERE table_schema = 'public'
+            AND table_name IN ('projects', 'datasets', 'patients', 'samples', 'files')
+        """)
+
+        existing_tables = [row['table_name'] for row in cur.fetchall()]
+        print(f"Existing tables: {existing_tables}")
+
+        # Indexes, unique keys and later schema changes
+        migrate_postgresql(conn)
+
+    def projects(self):
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+            cursor.execute("SELECT id, name, status FROM projects")
+            return cursor.fetchall()
+
+    def project_version(self, project_id: int):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            execute_statement(cursor, 'project_version', (project_id,))
+            row = cursor.fetchone()
+            conn.commit()
+            return row[0] if row else None
+
+    def datasets(self, dataset_id: int, project_id: int):
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+            if dataset_id != 0:
+                cursor.execute('SELECT id, project_id, name FROM datasets WHERE project_id = %s AND id = %s', (project_id, dataset_id,))
+            else:
+                cursor.execute('SELECT id, project_id, name FROM datasets WHERE project_id = %s', (project_id,))
+            return cursor.fetchall()
+
+    def dataset_with_metadata(self, dataset_id: int, project_id: int):
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+
+            # Fetch dataset details
+            execute_statement(cursor, 'dataset_by_id', (dataset_id, project_id))
+            dataset_row = cursor.fetchone()
+
+            if not dataset_row:
+                return None
+
+            # Fetch dataset metadata
+            execute_statement(cursor, 'dataset_metadata', (dataset_id,))
+            metadata_rows = cursor.fetchall()
+
+        return {**dataset_row, "metadata": metadata_rows}
+
+    def iter_patients(self, project_id: int, patient_id: int, limit: Optional[int] = None, after: int = 0,
+                      stream: bool = False, fields: Optional[frozenset] = None):
+        with self.connection() as conn:
+            cursor = self.stream_cursor(conn, 'patients') if stream else self.cursor(conn)
+
+            execute_statement(cursor, 'project_patients_sample_counts', (project_id, after, limit))
+
+            yield from cursor
+
+    def iter_patients_metadata(self, project_id: int, patient_id: int, limit: Optional[int] = None, after: int = 0,
+                               stream: bool = False, fields: Optional[frozenset] = None):
+        selected, params = select_listing(PATIENT_SELECTIONS, patient_id, project_id, limit, after, '%s')
+
+        with self.connection() as conn:
+            def query(name, sql, params):
+                cursor = self.stream_cursor(conn, name) if stream else self.cursor(conn)
+                cursor.execute(sql, params)
+                return cursor
+
+            yield from patients_with_samples(query, selected, params, fields)
+
+    # The metadata and patient joins only run when those fields are wanted
+    def iter_samples(self, sample_id: int, project_id: int, limit: Optional[int] = None, after: int = 0,
+                     stream: bool = False, fields: Optional[frozenset] = None):
+        selected, params = select_listing(SAMPLE_SELECTIONS, sample_id, project_id, limit, after, '%s')
+        with_metadata = wants(fields, 'metadata')
+        with_patient = wants(fields, 'patient')
+
+        with self.connection() as conn:
+            cursor = self.stream_cursor(conn, 'samples') if stream else self.cursor(conn)
+            if with_metadata and with_patient:
+                execute_statement(cursor, 'sample_by_id' if sample_id != 0 else 'project_samples', params)
+            else:
+                cursor.execute(sample_rows_sql(selected, with_metadata, with_patient), params)
+
+            yield from group_sample_rows(cursor, with_patient=with_patient, with_metadata=with_metadata)
+
+    def iter_patients_metadata_json(self, project_id: int, patient_id: int, limit: Optional[int] = None,
+                                    after: int = 0, stream: bool = False):
+        with self.connection() as conn:
+            cursor = self.stream_cursor(conn, 'patients_json') if stream else self.cursor(conn)
+            if patient_id != 0:
+                execute_statement(cursor, 'patient_by_id_json', (project_id, patient_id))
+            else:
+                execute_statement(cursor, 'project_patients_json', (project_id, after, limit))
+            yield from cursor
+
+    def iter_samples_json(self, sample_id: int, project_id: int, limit: Optional[int] = None, after: int = 0,
+                          stream: bool = False):
+        with self.connection() as conn:
+            cursor = self.stream_cursor(conn, 'samples_json') if stream else self.cursor(conn)
+            if sample_id != 0:
+                execute_statement(cursor, 'sample_by_id_json', (project_id, sample_id))
+            else:
+                execute_statement(cursor, 'project_samples_json', (project_id, after, limit))
+            yield from cursor
+
+    def raw_files_with_metadata(self, dataset_id: int):
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+
+            # Query to get raw files and their associated metadata
+            query = """
+            SELECT rf.id, rf.path, rfm.metadata_value AS sample_id, s.ext_sample_id
+            FROM files rf
+            LEFT JOIN files_metadata rfm ON rf.id = rfm.raw_file_id
+            LEFT JOIN samples s ON rfm.metadata_value::integer = s.id
+            WHERE rf.dataset_id = %s AND rfm.metadata_key = 'sample_id'
+            ORDER BY rf.id
+            """
+            cursor.execute(query, (dataset_id,))
+            raw_files = [raw_file for raw_file in cursor.fetchall() if raw_file['sample_id']]
+
+            # Fetch the metadata of every referenced sample in one query, grouped by sample so
+            # files that share a sample share the same metadata list
+            sample_ids = sorted({int(raw_file['sample_id']) for raw_file in raw_files})
+            cursor.execute(
+                "SELECT id, sample_id, key, value FROM samples_metadata WHERE sample_id = ANY(%s) ORDER BY id",
+                (sample_ids,)
+            )
+            sample_metadata = {}
+            for row in cursor:
+                sample_metadata.setdefault(row['sample_id'], []).append(row)
+
+        return [
+            {**raw_file, 'sample_metadata': sample_metadata.get(int(raw_file['sample_id']), [])}
+            for raw_file in raw_files
+        ]
+
+    def add_raw_files(self, wanted):
+        counts = {"files_added": 0, "files_existing": 0, "metadata_added": 0, "metadata_updated": 0}
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+
+            file_keys = list(wanted)
+            for start in range(0, len(file_keys), BULK_INSERT_BATCH_SIZE):
+                batch = {file_key: wanted[file_key] for file_key in file_keys[start:start + BULK_INSERT_BATCH_SIZE]}
+
+                # Files already registered are left untouched
+                file_ids = select_file_ids(cursor, list(batch))
+                counts["files_existing"] += len(file_ids)
+
+                new_files = [file_key for file_key in batch if file_key not in file_ids]
+                if new_files:
+                    # ON CONFLICT covers a concurrent request registering the same path in between
+                    cursor.execute('''
+                        INSERT INTO files (dataset_id, path, file_type)
+                        SELECT dataset_id, path, 'raw'
+                        FROM unnest(%s::integer[], %s::text[]) AS f(dataset_id, path)
+                        ON CONFLICT (dataset_id, path) DO NOTHING
+                        RETURNING id, dataset_id, path
+                    ''', ([dataset_id for dataset_id, _ in new_files], [path for _, path in new_files]))
+                    added = {(row['dataset_id'], row['path']): row['id'] for row in cursor.fetchall()}
+                    counts["files_added"] += len(added)
+                    file_ids.update(added)
+                    if len(added) < len(new_files):
+                        file_ids.update(select_file_ids(cursor, [k for k in new_files if k not in added]))
+
+                existing = {}
+                cursor.execute('''
+                    SELECT raw_file_id, metadata_key, metadata_value
+                    FROM files_metadata
+                    WHERE raw_file_id = ANY(%s)
+                ''', (list(file_ids.values()),))
+                for row in cursor.fetchall():
+                    existing.setdefault(row['raw_file_id'], {}).setdefault(row['metadata_key'], set()).add(row['metadata_value'])
+
+                # Write only the metadata that is new or has a different value, one statement each
+                inserts, updates = diff_metadata(batch, file_ids, existing)
+                if inserts:
+                    copy_rows(cursor, 'files_metadata', ('raw_file_id', 'metadata_key', 'metadata_value'), inserts)
+                if updates:
+                    raw_file_id_column, key_column, value_column = zip(*updates)
+                    cursor.execute('''
+                        UPDATE files_metadata m
+                        SET metadata_value = u.metadata_value
+                        FROM unnest(%s::integer[], %s::text[], %s::text[]) AS u(raw_file_id, metadata_key, metadata_value)
+                        WHERE m.raw_file_id = u.raw_file_id AND m.metadata_key = u.metadata_key
+                    ''', (list(raw_file_id_column), list(key_column), list(value_column)))
+                counts["metadata_added"] += len(inserts)
+                counts["metadata_updated"] += len(updates)
+
+            # Bumped last, so the projects rows stay locked only until the commit
+            if counts["files_added"] or counts["metadata_added"] or counts["metadata_updated"]:
+                cursor.execute(bump_project_versions_sql('datasets', ARRAY_IDS),
+                               (sorted({dataset_id for dataset_id, _ in wanted}),))
+            conn.commit()
+        return counts
+
+    def upsert_dataset_metadata(self, latest):
+        # ON CONFLICT cannot touch a row twice in one statement; `latest` holds each key once
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+            cursor.execute('''
+                INSERT INTO datasets_metadata (dataset_id, key, value)
+                SELECT * FROM unnest(%s::integer[], %s::text[], %s::text[])
+                ON CONFLICT (dataset_id, key) DO UPDATE SET value = EXCLUDED.value
+                WHERE datasets_metadata.value IS DISTINCT FROM EXCLUDED.value
+            ''', ([dataset_id for dataset_id, _ in latest], [key for _, key in latest], list(latest.values())))
+            written = cursor.rowcount
+            if written:
+                cursor.execute(bump_project_versions_sql('datasets', ARRAY_IDS),
+                               (sorted({dataset_id for dataset_id, _ in latest}),))
+            conn.commit()
+        return written
+
+    def patient_ids(self, project_id: int):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ext_patient_id, id FROM patients WHERE project_id = %s", (project_id,))
+            patient_ids = dict(cursor.fetchall())
+            conn.commit()
+            return patient_ids
+
+    def import_patients(self, rows):
+        return self._import_rows('patients', rows)
+
+    def import_samples(self, rows):
+        return self._import_rows('samples', rows)
+
+    # Upsert by natural key (owner, external id): new rows are inserted, and of existing
+    # ones only a changed url or metadata value is written
+    def _import_rows(self, table, rows):
+        owner_column, ext_column, url_column, metadata_table, metadata_owner = IMPORT_TABLES[table]
+        wanted = merge_import_rows(rows)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            def select_ids(natural_keys):
+                cursor.execute(f'''
+                    SELECT t.id, t.{owner_column}, t.{ext_column}, t.{url_column}
+                    FROM {table} t
+                    JOIN unnest(%s::integer[], %s::text[]) AS k(owner, ext_id)
+                      ON t.{owner_column} = k.owner AND t.{ext_column} = k.ext_id
+                ''', ([owner for owner, _ in natural_keys], [ext_id for _, ext_id in natural_keys]))
+                return {(owner, ext_id): (row_id, url) for row_id, owner, ext_id, url in cursor.fetchall()}
+
+            found = select_ids(list(wanted))
+            ids = {natural_key: row_id for natural_key, (row_id, _) in found.items()}
+
+            existing = {}
+            cursor.execute(f'''
+                SELECT {metadata_owner}, key, value FROM {metadata_table}
+                WHERE {metadata_owner} = ANY(%s)
+            ''', (list(ids.values()),))
+            for owner_id, key, value in cursor.fetchall():
+                existing.setdefault(owner_id, {}).setdefault(key, set()).add(value)
+
+            new_rows = [natural_key for natural_key in wanted if natural_key not in ids]
+            added = 0
+            if new_rows:
+                # ON CONFLICT covers a concurrent import adding the same rows in between
+                cursor.execute(f'''
+                    INSERT INTO {table} ({owner_column}, {ext_column}, {url_column})
+                    SELECT * FROM unnest(%s::integer[], %s::text[], %s::text[])
+                    ON CONFLICT ({owner_column}, {ext_column}) DO NOTHING
+                    RETURNING id, {owner_column}, {ext_column}
+                ''', ([owner for owner, _ in new_rows], [ext_id for _, ext_id in new_rows],
+                      [new_row_url(wanted[natural_key][0]) for natural_key in new_rows]))
+                inserted = {(owner, ext_id): row_id for row_id, owner, ext_id in cursor.fetchall()}
+                added = len(inserted)
+                ids.update(inserted)
+                if added < len(new_rows):
+                    ids.update((natural_key, row_id) for natural_key, (row_id, _) in
+                               select_ids([k for k in new_rows if k not in inserted]).items())
+
+            url_updates = [(row_id, wanted[natural_key][0]) for natural_key, (row_id, url) in found.items()
+                           if wanted[natural_key][0] is not None and url != wanted[natural_key][0]]
+            if url_updates:
+                cursor.execute(f'''
+                    UPDATE {table} t SET {url_column} = u.url
+                    FROM unnest(%s::integer[], %s::text[]) AS u(id, url)
+                    WHERE t.id = u.id
+                ''', ([row_id for row_id, _ in url_updates], [url for _, url in url_updates]))
+
+            inserts, updates = diff_metadata({natural_key: metadata for natural_key, (_, metadata) in wanted.items()},
+                                             ids, existing)
+            if inserts:
+                copy_rows(cursor, metadata_table, (metadata_owner, 'key', 'value'), inserts)
+            if updates:
+                owner_id_column, key_column, value_column = zip(*updates)
+                cursor.execute(f'''
+                    UPDATE {metadata_table} m
+                    SET value = u.value
+                    FROM unnest(%s::integer[], %s::text[], %s::text[]) AS u(owner_id, key, value)
+                    WHERE m.{metadata_owner} = u.owner_id AND m.key = u.key
+                ''', (list(owner_id_column), list(key_column), list(value_column)))
+            if added or url_updates or inserts or updates:
+                cursor.execute(bump_project_versions_sql(IMPORT_OWNER_TABLES[table], ARRAY_IDS),
+                               (sorted({owner for owner, _ in wanted}),))
+            conn.commit()
+
+        return import_counts(found, added, [row_id for row_id, _ in url_updates], inserts, updates)
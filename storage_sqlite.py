@@ -0,0 +1,496 @@
+import functools
+import json
+import sqlite3
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Optional
+
+import sqlite_db
+from migrations import LATEST_VERSION, migrate_sqlite, sqlite_schema_version
+from sqlite_db import SQLitePool, ReplicaPool, PoolTimeout, GroupCommitWriter
+from fieldsets import wants
+from storage import (Storage, IMPORT_TABLES, IMPORT_OWNER_TABLES, PATIENT_SELECTIONS, SAMPLE_SELECTIONS,
+                     bump_project_versions_sql, diff_metadata, group_sample_rows, import_counts, merge_import_rows,
+                     new_row_url, patients_with_samples, sample_rows_sql, select_listing)
+
+# Ids passed to bump_project_versions_sql as one JSON array parameter
+JSON_IDS = "SELECT value FROM json_each(?)"
+
+
+def transaction(func):
+    """Write method running func(self, conn, *args) in a write transaction and returning once it has committed
+
+    SQLiteStorage.submit starts the same transaction without waiting for it.
+    """
+    @functools.wraps(func)
+    def write(self, *args):
+        return self.submit(write, *args).result()
+    write.transaction = func
+    return write
+
+
+class SQLiteStorage(Storage):
+    """Storage on a single SQLite file.
+
+    Reads run on the pool's read-only connections in parallel (WAL). Writes
+    go through a GroupCommitWriter on the pool's single writer connection, so
+    concurrent requests share transactions instead of queueing for the lock;
+    batches go through executemany and json_each so a request costs a fixed
+    number of statements however many rows it touches.
+
+    With `replica=True` the readers query an in-memory copy of the file
+    instead (see ReplicaPool); a write returns once the copy includes it.
+    """
+
+    name = 'sqlite'
+    errors = (sqlite3.Error,)
+    busy_errors = (PoolTimeout,)
+
+    def __init__(self, path, readers=8, timeout=30.0, max_workers=8, prewarm_readers=2, write_batch=64,
+                 replica=False, replica_poll=5.0):
+        super().__init__()
+        self.path = path
+        self.max_workers = max_workers
+        self.prewarm_readers = prewarm_readers
+        self.replica = replica
+        # Long-lived connections: read-only ones for the GET routes and a single writer
+        if replica:
+            self.pool = ReplicaPool(path, readers=readers, timeout=timeout, poll_interval=replica_poll)
+        else:
+            self.pool = SQLitePool(path, readers=readers, timeout=timeout)
+        # A batch of 1 commits every write on its own, on the calling thread
+        self.writer = (GroupCommitWriter(self.pool, max_batch=write_batch, on_commit=self._committed)
+                       if write_batch > 1 else None)
+
+    def prewarm(self):
+        self.pool.prewarm(self.prewarm_readers)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.pool.close()
+        sqlite_db.close_all()
+
+    def submit(self, write, *args):
+        """Start a write method (see transaction); the Future completes once it has committed
+
+        With group commit the transaction is only queued for the writer thread;
+        without, it runs and commits on the calling thread.
+        """
+        func = functools.partial(write.transaction, self)
+        if self.writer:
+            return self.writer.submit(func, *args)
+        future = Future()
+        try:
+            with self.connection(write=True) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                result = func(conn, *args)
+                conn.commit()
+            self._committed()
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        return future
+
+    def _committed(self):
+        # Reads after a write's response must see it
+        if self.replica:
+            self.pool.refresh()
+
+    @contextmanager
+    def connection(self, write=False):
+        """Borrow a pooled connection (read-only unless write=True) for the duration of a with-block"""
+        conn = self.pool.getconn(write=write)
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    def cursor(self, conn):
+        """Cursor whose rows can be read by column name"""
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor
+
+    # Initialize the database and create the tables if they don't exist
+    def init_db(self):
+        with self.connection(write=True) as conn:
+            # The version is only stamped once everything below has run, so an up-to-date
+            # database needs no DDL at all
+            if sqlite_schema_version(conn) < LATEST_VERSION:
+                self._create_schema(conn)
+
+    def _create_schema(self, conn):
+        cur = conn.cursor()
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            status TEXT
+        );
+        ''')
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS datasets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            name TEXT,
+            FOREIGN KEY (project_id) REFERENCES projects(id)
+        );
+        ''')
+
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS datasets_metadata (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dataset_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL
+        );
+        ''')
+
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS patients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            ext_patient_id TEXT,
+            ext_patient_url TEXT,
+            public_patient_id TEXT,
+            FOREIGN KEY (project_id) REFERENCES projects(id)
+        );
+        ''')
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS patients_metadata (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            key TEXT,
+            value TEXT,
+            FOREIGN KEY (patient_id) REFERENCES patients(id)
+        );
+        ''')
+
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS samples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            ext_sample_id TEXT,
+            ext_sample_url TEXT,
+            FOREIGN KEY (patient_id) REFERENCES patients(id)
+        );
+        ''')
+
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS samples_metadata (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sample_id INTEGER NOT NULL,
+            key TEXT,
+            value TEXT,
+            FOREIGN KEY (sample_id) REFERENCES samples(id)
+        );
+        ''')
+
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS raw_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dataset_id INTEGER NOT NULL,
+            path TEXT,
+            FOREIGN KEY (dataset_id) REFERENCES datasets(id)
+        );
+        ''')
+
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS raw_files_metadata (
+            metadata_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            raw_file_id INTEGER,
+            metadata_key TEXT NOT NULL,
+            metadata_value TEXT NOT NULL,
+            FOREIGN KEY (raw_file_id) REFERENCES raw_files (id)
+        );
+        ''')
+
+        conn.commit()
+
+        # Indexes, unique keys and later schema changes
+        migrate_sqlite(conn)
+
+    def projects(self):
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+            cursor.execute("SELECT id, name, status FROM projects")
+            return [dict(row) for row in cursor.fetchall()]
+
+    def project_version(self, project_id: int):
+        with self.connection() as conn:
+            row = conn.execute("SELECT data_version FROM projects WHERE id = ?", (project_id,)).fetchone()
+            return row[0] if row else None
+
+    def datasets(self, dataset_id: int, project_id: int):
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+            if dataset_id != 0:
+                cursor.execute('''SELECT id, project_id, name FROM datasets where project_id = ? and id = ?''', (project_id,dataset_id,))
+            else:
+                cursor.execute('''SELECT id, project_id, name FROM datasets where project_id = ?''', (project_id,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def dataset_with_metadata(self, dataset_id: int, project_id: int):
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+
+            # Fetch dataset details
+            cursor.execute('''
+                SELECT id, project_id, name
+                FROM datasets
+                WHERE id = ? AND project_id = ?
+            ''', (dataset_id, project_id))
+            dataset_row = cursor.fetchone()
+
+            if not dataset_row:
+                return None
+
+            # Fetch dataset metadata
+            cursor.execute('''
+                SELECT id, dataset_id, key, value
+                FROM datasets_metadata
+                WHERE dataset_id = ?
+                ORDER BY id
+            ''', (dataset_id,))
+            metadata_rows = cursor.fetchall()
+
+        return {**dict(dataset_row), "metadata": [dict(row) for row in metadata_rows]}
+
+    # Rows are read from the cursor as they are consumed, so `stream` needs no special cursor here
+    def iter_patients(self, project_id: int, patient_id: int, limit: Optional[int] = None, after: int = 0,
+                      stream: bool = False, fields: Optional[frozenset] = None):
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+
+            # Sample counts are kept on patients by triggers (migration 4), so a page is one index range
+            cursor.execute('''
+                SELECT id, project_id, ext_patient_id, ext_patient_url, public_patient_id, sample_count
+                FROM patients
+                WHERE project_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (project_id, after, -1 if limit is None else limit))
+
+            for row in cursor:
+                yield dict(row)
+
+    def iter_patients_metadata(self, project_id: int, patient_id: int, limit: Optional[int] = None, after: int = 0,
+                               stream: bool = False, fields: Optional[frozenset] = None):
+        selected, params = select_listing(PATIENT_SELECTIONS, patient_id, project_id, -1 if limit is None else limit,
+                                          after, '?')
+
+        with self.connection() as conn:
+            def query(name, sql, params):
+                cursor = self.cursor(conn)
+                cursor.execute(sql, params)
+                return cursor
+
+            yield from patients_with_samples(query, selected, params, fields)
+
+    # The metadata and patient joins only run when those fields are wanted
+    def iter_samples(self, sample_id: int, project_id: int, limit: Optional[int] = None, after: int = 0,
+                     stream: bool = False, fields: Optional[frozenset] = None):
+        selected, params = select_listing(SAMPLE_SELECTIONS, sample_id, project_id, -1 if limit is None else limit,
+                                          after, '?')
+        with_metadata = wants(fields, 'metadata')
+        with_patient = wants(fields, 'patient')
+
+        with self.connection() as conn:
+            cursor = self.cursor(conn)
+            cursor.execute(sample_rows_sql(selected, with_metadata, with_patient), params)
+
+            yield from group_sample_rows(cursor, with_patient=with_patient, with_metadata=with_metadata)
+
+    def raw_files_with_metadata(self, dataset_id: int):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Query to get raw files and their associated metadata
+            query = """
+            SELECT rf.id, rf.path, rfm.metadata_value AS sample_id, s.ext_sample_id
+            FROM raw_files rf
+            LEFT JOIN raw_files_metadata rfm ON rf.id = rfm.raw_file_id
+            LEFT JOIN samples s ON rfm.metadata_value = s.id
+            WHERE rf.dataset_id = ? AND rfm.metadata_key = 'sample_id'
+            ORDER BY rf.id
+            """
+            cursor.execute(query, (dataset_id,))
+            raw_files = cursor.fetchall()
+
+            # Fetch the metadata of every referenced sample in one query, grouped by sample so
+            # files that share a sample share the same metadata list
+            sample_ids = sorted({raw_file[2] for raw_file in raw_files})
+            cursor.execute("""
+                SELECT id, sample_id, key, value
+                FROM samples_metadata
+                WHERE sample_id IN (SELECT value FROM json_each(?))
+                ORDER BY id
+            """, (json.dumps(sample_ids),))
+            sample_metadata = {}
+            for row in cursor:
+                sample_metadata.setdefault(str(row[1]), []).append(
+                    {'id': row[0], 'sample_id': row[1], 'key': row[2], 'value': row[3]}
+                )
+
+        return [
+            {
+                'id': raw_file_id,
+                'path': path,
+                'sample_id': sample_id,
+                'ext_sample_id': ext_sample_id,
+                'sample_metadata': sample_metadata.get(sample_id, [])
+            }
+            for raw_file_id, path, sample_id, ext_sample_id in raw_files
+        ]
+
+    # Runs inside a write transaction that holds the write lock, so no other writer
+    # can register the same paths in between
+    @transaction
+    def add_raw_files(self, conn, wanted):
+        paths_by_dataset = {}
+        for dataset_id, path in wanted:
+            paths_by_dataset.setdefault(dataset_id, []).append(path)
+
+        cursor = conn.cursor()
+
+        # Look up the files that are already registered, one indexed query per dataset
+        file_ids = {}
+        for dataset_id, paths in paths_by_dataset.items():
+            cursor.execute('''
+                SELECT id, path FROM raw_files
+                WHERE dataset_id = ? AND path IN (SELECT value FROM json_each(?))
+                ORDER BY id
+            ''', (dataset_id, json.dumps(paths)))
+            for raw_file_id, path in cursor.fetchall():
+                file_ids.setdefault((dataset_id, path), raw_file_id)
+
+        existing = {}
+        if file_ids:
+            cursor.execute('''
+                SELECT raw_file_id, metadata_key, metadata_value
+                FROM raw_files_metadata
+                WHERE raw_file_id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(list(file_ids.values())),))
+            for raw_file_id, key, value in cursor.fetchall():
+                existing.setdefault(raw_file_id, {}).setdefault(key, set()).add(value)
+
+        # Insert only the new files in one batch; AUTOINCREMENT hands out ascending ids in insertion order
+        new_files = [file_key for file_key in wanted if file_key not in file_ids]
+        if new_files:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM raw_files")
+            last_id = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO raw_files (dataset_id, path)
+                VALUES (?, ?)
+            ''', new_files)
+            cursor.execute("SELECT id FROM raw_files WHERE id > ? ORDER BY id", (last_id,))
+            file_ids.update(zip(new_files, (row[0] for row in cursor.fetchall())))
+
+        # Write only the metadata that is new or has a different value
+        inserts, updates = diff_metadata(wanted, file_ids, existing)
+        cursor.executemany('''
+            INSERT INTO raw_files_metadata (raw_file_id, metadata_key, metadata_value)
+            VALUES (?, ?, ?)
+        ''', inserts)
+        cursor.executemany('''
+            UPDATE raw_files_metadata SET metadata_value = ?3
+            WHERE raw_file_id = ?1 AND metadata_key = ?2
+        ''', updates)
+        if new_files or inserts or updates:
+            cursor.execute(bump_project_versions_sql('datasets', JSON_IDS), (json.dumps(list(paths_by_dataset)),))
+
+        return {
+            "files_added": len(new_files),
+            "files_existing": len(wanted) - len(new_files),
+            "metadata_added": len(inserts),
+            "metadata_updated": len(updates),
+        }
+
+    @transaction
+    def upsert_dataset_metadata(self, conn, latest):
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO datasets_metadata (dataset_id, key, value)
+            SELECT json_extract(item.value, '$[0]'), json_extract(item.value, '$[1]'), json_extract(item.value, '$[2]')
+            FROM json_each(?) AS item
+            WHERE true
+            ON CONFLICT (dataset_id, key) DO UPDATE SET value = excluded.value
+            WHERE datasets_metadata.value IS NOT excluded.value
+        ''', (json.dumps([[dataset_id, key, value] for (dataset_id, key), value in latest.items()]),))
+        written = cursor.rowcount
+        if written:
+            cursor.execute(bump_project_versions_sql('datasets', JSON_IDS),
+                           (json.dumps(sorted({dataset_id for dataset_id, _ in latest})),))
+        return written
+
+    def patient_ids(self, project_id: int):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ext_patient_id, id FROM patients WHERE project_id = ?", (project_id,))
+            return dict(cursor.fetchall())
+
+    @transaction
+    def import_patients(self, conn, rows):
+        return self._import_rows(conn, 'patients', rows)
+
+    @transaction
+    def import_samples(self, conn, rows):
+        return self._import_rows(conn, 'samples', rows)
+
+    # Upsert by natural key (owner, external id) inside the write transaction: new rows
+    # are inserted, and of existing ones only a changed url or metadata value is written
+    def _import_rows(self, conn, table, rows):
+        owner_column, ext_column, url_column, metadata_table, metadata_owner = IMPORT_TABLES[table]
+        wanted = merge_import_rows(rows)
+        cursor = conn.cursor()
+
+        def select_ids(natural_keys):
+            cursor.execute(f'''
+                SELECT t.id, t.{owner_column}, t.{ext_column}, t.{url_column}
+                FROM json_each(?) AS k
+                JOIN {table} t ON t.{owner_column} = json_extract(k.value, '$[0]')
+                              AND t.{ext_column} = json_extract(k.value, '$[1]')
+            ''', (json.dumps(natural_keys),))
+            return {(owner, ext_id): (row_id, url) for row_id, owner, ext_id, url in cursor.fetchall()}
+
+        found = select_ids(list(wanted))
+        ids = {natural_key: row_id for natural_key, (row_id, _) in found.items()}
+
+        existing = {}
+        if ids:
+            cursor.execute(f'''
+                SELECT {metadata_owner}, key, value FROM {metadata_table}
+                WHERE {metadata_owner} IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(list(ids.values())),))
+            for owner_id, key, value in cursor.fetchall():
+                existing.setdefault(owner_id, {}).setdefault(key, set()).add(value)
+
+        new_rows = [natural_key for natural_key in wanted if natural_key not in ids]
+        if new_rows:
+            cursor.executemany(f'''
+                INSERT INTO {table} ({owner_column}, {ext_column}, {url_column})
+                VALUES (?, ?, ?)
+            ''', [(owner, ext_id, new_row_url(wanted[(owner, ext_id)][0])) for owner, ext_id in new_rows])
+            ids.update((natural_key, row_id) for natural_key, (row_id, _) in select_ids(new_rows).items())
+
+        url_updates = [(wanted[natural_key][0], row_id) for natural_key, (row_id, url) in found.items()
+                       if wanted[natural_key][0] is not None and url != wanted[natural_key][0]]
+        cursor.executemany(f"UPDATE {table} SET {url_column} = ? WHERE id = ?", url_updates)
+
+        inserts, updates = diff_metadata({natural_key: metadata for natural_key, (_, metadata) in wanted.items()},
+                                         ids, existing)
+        cursor.executemany(f'''
+            INSERT INTO {metadata_table} ({metadata_owner}, key, value)
+            VALUES (?, ?, ?)
+        ''', inserts)
+        cursor.executemany(f'''
+            UPDATE {metadata_table} SET value = ?3
+            WHERE {metadata_owner} = ?1 AND key = ?2
+        ''', updates)
+        if new_rows or url_updates or inserts or updates:
+            cursor.execute(bump_project_versions_sql(IMPORT_OWNER_TABLES[table], JSON_IDS),
+                           (json.dumps(sorted({owner for owner, _ in wanted})),))
+
+        return import_counts(found, len(new_rows), [row_id for _, row_id in url_updates], inserts, updates)
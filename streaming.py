@@ -0,0 +1,52 @@
+from fastapi.responses import Response, StreamingResponse
+
+# Streaming mode for listing endpoints: a client sending
+# `Accept: application/x-ndjson` gets one JSON document per line, serialized
+# as rows arrive from the database cursor instead of after the whole result
+# has been built in memory.
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+# Lines are sent in chunks of about this size; each chunk is one hop to the
+# worker thread that drives the database cursor
+FLUSH_BYTES = 64 * 1024
+
+
+def wants_ndjson(request):
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def chunks(lines):
+    """Join lines into chunks of about FLUSH_BYTES"""
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def ndjson_lines(documents, model):
+    """Validate each document against `model` and emit it as one JSON line"""
+    return chunks(model.model_validate(document).model_dump_json() + '\n' for document in documents)
+
+
+def ndjson_response(documents, model):
+    return StreamingResponse(ndjson_lines(documents, model), media_type=NDJSON_MEDIA_TYPE)
+
+
+# Documents the database already built as JSON text ({'id': ..., 'document': ...}
+# rows, see Storage.json_documents) are sent as they are
+
+def ndjson_text_response(rows):
+    return StreamingResponse(chunks(row['document'] + '\n' for row in rows), media_type=NDJSON_MEDIA_TYPE)
+
+
+def json_text_response(rows):
+    """A JSON array of the rows' documents"""
+    return Response('[' + ','.join(row['document'] for row in rows) + ']', media_type='application/json')